@@ -163,16 +163,46 @@ if __name__ == "__main__":
 	# Catch Ctrl+C
 	signal.signal(signal.SIGINT, signal_handler)
 
+	usage = 'main.py -d <database> [-e <json|csv> [-o <output>] [--with-passwords]]'
+
 	try:
-		opts, args = getopt.getopt(sys.argv[1:], "d:",["database="])
+		opts, args = getopt.getopt(sys.argv[1:], "hd:e:o:",["database=", "export=", "output=", "with-passwords"])
 	except getopt.GetoptError:
-		print('main.py -d <database>')
+		print(usage)
 		sys.exit(2)
 
+	path = None
+	export_format = None
+	output = None
+	with_passwords = False
+
 	for opt, arg in opts:
 		if opt == '-h':
-			print('main.py -d <database>')
+			print(usage)
 			sys.exit()
 		elif opt in ("-d", "--database"):
-			kc = Keepass_Client(arg)
-			kc.show_menu_main()
+			path = arg
+		elif opt in ("-e", "--export"):
+			export_format = arg
+		elif opt in ("-o", "--output"):
+			output = arg
+		elif opt == "--with-passwords":
+			with_passwords = True
+
+	if path is None:
+		print(usage)
+		sys.exit(2)
+
+	if export_format:
+		passphrase = "test" #input("Passphrase: ")
+
+		if output:
+			with open(output, "w", encoding="utf-8", newline="") as f_out:
+				count = keepass.export_file(path, passphrase, f_out, export_format, with_passwords)
+
+			print("Exported {} entries".format(count))
+		else:
+			keepass.export_file(path, passphrase, sys.stdout, export_format, with_passwords)
+	else:
+		kc = Keepass_Client(path)
+		kc.show_menu_main()
@@ -0,0 +1,125 @@
+import asyncio
+import weakref
+import functools
+import threading
+
+from .file import File
+
+# Maximum number of opens, saves and attachment reads running at once
+limit = 4
+
+# Executor running the blocking work, None for the loop's default executor
+executor = None
+
+# Event loop -> semaphore
+_semaphores = weakref.WeakKeyDictionary()
+
+def configure(max_concurrency=None, thread_executor=None):
+	"""
+	Set concurrency limit and executor
+	Only affects calls made afterwards
+
+	@param int max_concurrency
+	@param concurrent.futures.Executor thread_executor
+	"""
+	global limit
+	global executor
+
+	if max_concurrency is not None:
+		limit = max_concurrency
+		_semaphores.clear()
+
+	if thread_executor is not None:
+		executor = thread_executor
+
+async def open(path, passphrase, lazy=False, key_cache=None, concurrent=False):
+	"""
+	Open and decrypt a database without blocking the event loop
+	Cancelling the call stops the key transformation
+
+	@param string path
+	@param string passphrase
+	@param bool lazy Only decrypt protected values when they are accessed
+	@param KeyCache key_cache Optional cache of transformed keys
+	@param bool concurrent Guard the database for use by several threads
+	@return File Opened file, see File.database
+	"""
+	file = File(path, passphrase, key_cache, concurrent=concurrent)
+	file.cancel = threading.Event()
+
+	await _run(file.open, lazy, cancel=file.cancel)
+
+	file.cancel = None
+
+	return file
+
+async def save(file, path=None):
+	"""
+	Encrypt and write a database without blocking the event loop
+	Once started, a save always runs to completion, so cancelling the
+	call never leaves a partially written file behind
+
+	@param File file
+	@param string path Defaults to the path the file was opened from
+	"""
+	await _run(file.save, path)
+
+async def get_attachment(database, id, path=None):
+	"""
+	Get attachment content without blocking the event loop
+
+	@param Database database
+	@param string id
+	@param string path Write content to this file instead of returning it
+	@return bytes Content, None if written to `path`
+	"""
+	if path is not None:
+		return await _run(database.save_attachment, id, path)
+
+	return await _run(_read_attachment, database, id)
+
+def _read_attachment(database, id):
+	with database.open_attachment(id) as reader:
+		return reader.read()
+
+def _get_semaphore():
+	"""
+	Get the semaphore enforcing the concurrency limit in the running loop
+
+	@return asyncio.Semaphore
+	"""
+	loop = asyncio.get_running_loop()
+
+	if loop not in _semaphores:
+		_semaphores[loop] = asyncio.Semaphore(limit)
+
+	return _semaphores[loop]
+
+async def _run(func, *args, cancel=None):
+	"""
+	Run blocking function in the executor, limited by the semaphore
+	On cancellation `cancel` is set and the slot is kept until the
+	function has returned, so the limit also holds for abandoned work
+
+	@param callable func
+	@param threading.Event cancel
+	@return mixed Result of `func`
+	"""
+	loop = asyncio.get_running_loop()
+
+	async with _get_semaphore():
+		future = loop.run_in_executor(executor, functools.partial(func, *args))
+
+		try:
+			return await asyncio.shield(future)
+		except asyncio.CancelledError:
+			if cancel is not None:
+				cancel.set()
+
+			await asyncio.wait([future])
+
+			# Result is discarded, retrieve the exception so it isn't logged
+			if not future.cancelled():
+				future.exception()
+
+			raise
@@ -1,5 +1,10 @@
+from lxml import etree
+
 from . import util
 
+XPATH_VALUE = etree.XPath('./Value')
+XPATH_REF = etree.XPath('./Value/@Ref')
+
 class Attachment:
 	def __init__(self, xml):
 		self.xml = xml
@@ -16,12 +21,12 @@ class Attachment:
 		}
 
 		xml = util.dict_to_xml("Binary", attachment)
-		xml.xpath('./Value')[0].set('Ref', id)
+		XPATH_VALUE(xml)[0].set('Ref', id)
 
 		return cls(xml)
 
 	def get_id(self):
-		return self.xml.xpath('./Value/@Ref')[0]
+		return XPATH_REF(self.xml)[0]
 
 	def get_filename(self):
 		return self.xml.find('Key').text
@@ -1,9 +1,13 @@
 import hashlib
 import struct
-from Crypto.Cipher import AES
+import threading
+from Crypto.Cipher import Salsa20
 
 AES_BLOCK_SIZE = 16
 
+# Fixed IV of the Salsa20 inner random stream
+SALSA20_IV = bytes(bytearray.fromhex('e830094b97205d2a'))
+
 def sha256(s):
 	"""
 	Return SHA256 digest of a string
@@ -32,24 +36,65 @@ def unpad(s):
 	"""
 	return s[:-ord(s[-1:])]
 
-def aes_cbc_encrypt(data, key, enc_iv):
+def xor(aa, bb):
 	"""
-	Encrypt data using AES in CBC mode
+	Return a bytewise XOR
+	Both operands are XORed as a whole as big integers instead of byte by byte
 
-	@param bytes data
-	@param bytes key
-	@param bytes enc_iv
+	@param bytes aa
+	@param bytes bb
 	@return bytes
 	"""
-	cipher = AES.new(key, AES.MODE_CBC, enc_iv)
-	return cipher.encrypt(data)
+	length = min(len(aa), len(bb))
 
-def xor(aa, bb):
+	if length == 0:
+		return b''
+
+	a = int.from_bytes(memoryview(aa)[:length], 'little')
+	b = int.from_bytes(memoryview(bb)[:length], 'little')
+
+	return (a ^ b).to_bytes(length, 'little')
+
+def salsa20(key):
 	"""
-	Return a bytearray of a bytewise XOR
+	Create the Salsa20 cipher of the inner random stream
 
-	@param bytes aa
-	@param bytes bb
-	@return bytearray
+	@param bytes key Protected stream key
+	@return Salsa20
 	"""
-	return bytearray([a ^ b for a, b in zip(bytearray(aa), bytearray(bb))])
+	return Salsa20.new(sha256(key), SALSA20_IV)
+
+class KeyStream:
+	"""
+	Salsa20 keystream used to protect values in the XML
+	The keystream is generated in large chunks and kept, so any section of
+	it can be addressed by its offset.
+	"""
+	chunk_size = 64 * 1024
+
+	def __init__(self, key):
+		"""
+		Constructor
+
+		@param bytes key Protected stream key
+		"""
+		self.cipher = salsa20(key)
+		self.buffer = bytearray()
+		self._lock = threading.Lock()
+
+	def get(self, offset, length):
+		"""
+		Get `length` keystream bytes starting at `offset`
+
+		@param int offset
+		@param int length
+		@return bytearray
+		"""
+		end = offset + length
+
+		with self._lock:
+			if end > len(self.buffer):
+				missing = max(end - len(self.buffer), self.chunk_size)
+				self.buffer.extend(self.cipher.encrypt(bytes(missing)))
+
+			return self.buffer[offset:end]
@@ -1,102 +1,309 @@
-import struct
 import hashlib
 import base64
 from lxml import etree, objectify
-from Crypto.Cipher import Salsa20
 import io
 import datetime
 import uuid
+from collections import defaultdict
 import re
+from collections import deque
+import os
+import copy
+import shutil
+import threading
 
 from . import crypto
+from . import streams
 from . import util
 from .group import Group
+from .entry import Entry
+from .index import Index
+from .search import SearchIndex
+from .record import EntryRecord, GroupRecord, Snapshot
+from .lock import RWLock, NULL_LOCK, reading, writing, modifying
+
+# Elements written child by child when streaming the XML
+STREAMED_TAGS = ('KeePassFile', 'Meta', 'Binaries', 'Root', 'Group')
+
+XPATH_META = etree.XPath('/KeePassFile/Meta')
+XPATH_PROTECT_PASSWORD = etree.XPath('/KeePassFile/Meta/MemoryProtection/ProtectPassword')
+XPATH_BINARIES = etree.XPath('/KeePassFile/Meta/Binaries')
+XPATH_BINARY = etree.XPath('/KeePassFile/Meta/Binaries/Binary[@ID = $id]')
+XPATH_ROOT_GROUP = etree.XPath('/KeePassFile/Root/Group')
+XPATH_GROUPS = etree.XPath('/KeePassFile/Root/Group/Group')
+XPATH_PROTECTED = etree.XPath('.//Value[@Protected]')
 
 class Database:
-	def __init__(self, stream, protected_stream_key):
+	"""
+	In concurrent mode all access goes through a readers-writer lock.
+	Hold `lock.read()` while consuming generators such as iter_groups()
+	or open_attachment()
+	"""
+	def __init__(self, stream, protected_stream_key, compressed=False, lazy=False, concurrent=False):
 		"""
 		Constructor
 
-		@param bytes stream
+		@param stream stream
 		@param string protected_stream_key
+		@param bool compressed Whether the payload is gzip compressed
+		@param bool lazy Only decrypt protected values when they are accessed
+		@param bool concurrent Guard the database for use by several threads
 		"""
 		self.protected_stream_key = protected_stream_key
+		self.compressed = compressed
+		self.lazy = lazy
+		self.concurrent = concurrent
+		self.lock = RWLock() if concurrent else NULL_LOCK
 
-		self.deserialize(stream)
+		# Readers revealing lazy values must not race each other
+		self._reveal_lock = threading.Lock() if concurrent else NULL_LOCK
+
+		# Number of modifications since loading
+		self.changes = 0
+		self._keystream = crypto.KeyStream(protected_stream_key)
+
+		# Keystream offset of every protected value
+		self._protected = {}
+
+		self.index = Index()
+
+		# Built on the first search, only kept up to date from then on
+		self.search_index = None
+
+		# Content hash -> binary ID and back, built on first use
+		self._binary_ids = None
+		self._binary_hashes = None
+		self._binary_max_id = 0
+
+		# Binary ID -> attachment elements referencing it, including history
+		self._binary_refs = defaultdict(set)
+
+		# Group path -> group element, built on first use
+		self._group_paths = None
+
+		if stream is not None:
+			self.deserialize(stream)
+
+	@classmethod
+	def fromxml(cls, xml, protected_stream_key, compressed=False, lazy=False, concurrent=False):
+		"""
+		Create database from decrypted XML
+
+		@param bytes xml
+		@param string protected_stream_key
+		@param bool compressed Whether to compress the payload on save
+		@param bool lazy Only decrypt protected values when they are accessed
+		@param bool concurrent Guard the database for use by several threads
+		@return Database
+		"""
+		database = cls(None, protected_stream_key, compressed, lazy, concurrent)
+		database.parse([xml])
+
+		return database
 
 	def deserialize(self, stream):
 		"""
-		Get database XML from bytes
-		Read bytes first, then unprotect values
+		Get database XML from hashed blocks
+		Blocks are verified, decompressed if necessary and fed into the
+		parser one by one, then values are unprotected
 
-		@param bytes stream
+		@param stream stream
 		"""
-		# Index (4 bytes)
-		index = struct.unpack('<I', stream.read(4))[0]
+		chunks = streams.iter_hashed_blocks(stream)
 
-		# Hash (32 bytes)
-		hash = struct.unpack('<32s', stream.read(32))[0]
+		if self.compressed:
+			chunks = streams.iter_gunzip(chunks)
 
-		# Length (4 bytes)
-		length = struct.unpack('<I', stream.read(4))[0]
+		self.parse(chunks)
 
-		# Data
-		data = struct.unpack('<{}s'.format(length), stream.read(length))[0]
+	def parse(self, chunks):
+		"""
+		Parse database XML, unprotect values and build the indexes
 
-		# Get root node
+		@param iterable[bytes] chunks
+		"""
 		parser = etree.XMLParser(remove_blank_text=True)
-		self.root = etree.fromstring(data, parser=parser)
+
+		for data in chunks:
+			parser.feed(data)
+
+		# Get root node
+		self.root = parser.close()
 
 		self.unprotect()
 
-	def hash(self):
+		self.index_add(self.root.find('Root'))
+
+		# Loading isn't a modification
+		self.changes = 0
+
+	def hash(self, out=None, header_hash=None, root=None, protected=None):
 		"""
-		Convert database XML to hashed blocks as bytes
+		Convert database XML to hashed blocks
+		The XML is streamed through the gzip stage if the database is
+		compressed and then split into hashed blocks
+
+		@param stream out Stream to write to, bytes are returned if omitted
+		@param string header_hash Written to Meta/HeaderHash if given
+		@param Element root Tree to write, defaults to the database
+		@param dict protected Keystream offsets of the values in `root`
+		@return bytes
+		"""
+		stream = out if out is not None else io.BytesIO()
+		writer = streams.HashedBlockWriter(stream)
 
-		@return bytearray
+		if self.compressed:
+			writer = streams.GzipWriter(writer)
+
+		self.write(writer, header_hash, root, protected)
+		writer.finish()
+
+		if out is None:
+			return stream.getvalue()
+
+	def write(self, out, header_hash=None, root=None, protected=None):
 		"""
-		stream = bytearray()
-		bytes = io.BytesIO(self.get())
-
-		index = 0
-		while True:
-			data = bytes.read(1024 * 1024)
-			if data:
-				stream.extend(struct.pack('<I', index))
-				stream.extend(hashlib.sha256(data).digest())
-				stream.extend(struct.pack('<I', len(data)))
-				stream.extend(data)
-				index += 1
-			else:
-				stream.extend(struct.pack('<I', index))
-				stream.extend(b'\x00' * 32)
-				stream.extend(struct.pack('<I', 0))
-				break
+		Serialize database XML to a stream
+		Containers are written child by child, so no serialized copy
+		of the whole document is created. Protected values are encrypted
+		on the way out, the tree itself is not changed
+
+		@param stream out
+		@param string header_hash Written to Meta/HeaderHash if given
+		@param Element root Tree to write, defaults to the database
+		@param dict protected Keystream offsets of the values in `root`
+		"""
+		if root is None:
+			root = self.root
+			protected = self._protected
+
+		with etree.xmlfile(out, encoding='utf-8') as xf:
+			xf.write_declaration(standalone=True)
+			self._write_element(xf, root, 0, header_hash, protected)
+
+	def _write_element(self, xf, elem, offset, header_hash, protected):
+		"""
+		Serialize a single element
+		Elements containing protected values are written as encrypted copies
+
+		@param xmlfile xf
+		@param Element elem
+		@param int offset Keystream offset of the next protected value
+		@param string header_hash
+		@param dict protected Keystream offsets of unrevealed values
+		@return int Keystream offset after the element
+		"""
+		if elem.tag not in STREAMED_TAGS:
+			if elem.tag == 'HeaderHash' and header_hash is not None:
+				elem = self._header_hash_element(header_hash)
+			elif elem.tag == 'MemoryProtection':
+				elem = copy.deepcopy(elem)
+
+				for protect_password in elem.iterchildren('ProtectPassword'):
+					protect_password.text = 'True'
+			elif XPATH_PROTECTED(elem):
+				elem, offset = self._protect_copy(elem, offset, protected)
+
+			xf.write(elem)
+			return offset
 
-		return stream
+		with xf.element(elem.tag, dict(elem.attrib)):
+			if elem.text:
+				xf.write(elem.text)
 
+			for child in elem:
+				offset = self._write_element(xf, child, offset, header_hash, protected)
 
-	def serialize(self, header_hash):
+			if elem.tag == 'Meta' and header_hash is not None and elem.find('HeaderHash') is None:
+				xf.write(self._header_hash_element(header_hash))
+
+		return offset
+
+	def _header_hash_element(self, header_hash):
 		"""
-		Get database as bytes
-		Protect values first, then convert XML to hashed blocks
+		Build Meta/HeaderHash element
 
 		@param string header_hash
-		@return bytearray
+		@return Element
+		"""
+		elem = etree.Element('HeaderHash')
+		elem.text = header_hash
+
+		return elem
+
+	def _protect_copy(self, elem, offset, protected):
+		"""
+		Get a copy of an element with all its values protected
+		Every value with 'Protected=False' is encrypted at the running
+		offset and its 'ProtectedValue' attribute is dropped. Values that
+		were never revealed are still ciphertext and are only re-encrypted
+		if their keystream offset moved
+
+		@param Element elem
+		@param int offset Keystream offset of the first value
+		@param dict protected Keystream offsets of unrevealed values
+		@return (Element, int) Copy and keystream offset after its last value
+		"""
+		with self._reveal_lock:
+			copied = copy.deepcopy(elem)
+
+			for live, value in zip(XPATH_PROTECTED(elem), XPATH_PROTECTED(copied)):
+				if value.text is None:
+					continue
+
+				if value.get('Protected') == 'True':
+					# Value that was never revealed, re-encrypt if its offset moved
+					old_offset, length = protected[live]
+
+					if old_offset != offset:
+						decoded = base64.b64decode(value.text.encode("utf-8"))
+						decrypted = crypto.xor(decoded, self._get_keystream(old_offset, length))
+						encrypted = crypto.xor(decrypted, self._get_keystream(offset, length))
+						value.text = base64.b64encode(encrypted).decode("utf-8")
+
+					offset += length
+				elif value.get('Protected') == 'False':
+					decrypted = value.text.encode("utf-8")
+					encrypted = crypto.xor(decrypted, self._get_keystream(offset, len(decrypted)))
+
+					value.attrib.pop('ProtectedValue', None)
+					value.set('Protected', 'True')
+					value.text = base64.b64encode(encrypted).decode("utf-8")
+
+					offset += len(decrypted)
+
+		return copied, offset
+
+	def serialize(self, header_hash, out=None):
+		"""
+		Get database as hashed blocks
+		Protected values are encrypted while the XML is written, so the
+		database stays unprotected and can be saved again right away.
+		In concurrent mode a copy of the tree is taken under the read lock
+		and written without holding it, so writers and the readers queued
+		behind them only wait for the copy
+
+		@param string header_hash
+		@param stream out Stream to write to, bytes are returned if omitted
+		@return bytes
 		"""
-		# Add header hash to Meta/HeaderHash
-		if len(self.root.xpath("/KeePassFile/Meta/HeaderHash")) < 1:
-			etree.SubElement(self.root.xpath("/KeePassFile/Meta")[0], "HeaderHash")
+		if not self.concurrent:
+			return self.hash(out, header_hash)
 
-		dom_header_hash = self.root.xpath("/KeePassFile/Meta/HeaderHash")[0]
-		dom_header_hash.text = header_hash
+		with self.lock.read(), self._reveal_lock:
+			root = copy.deepcopy(self.root)
 
-		# Protect
-		self.protect()
+			# Map offsets of unrevealed values to the copied elements
+			protected = {}
 
-		# Return database as hashed blocks
-		return self.hash()
+			if self._protected:
+				for value, copied in zip(self.root.iter('Value'), root.iter('Value')):
+					if value in self._protected:
+						protected[copied] = self._protected[value]
 
+		return self.hash(out, header_hash, root, protected)
+
+	@reading
 	def get(self, print=False):
 		"""
 		Return pretty printed database
@@ -109,46 +316,67 @@ class Database:
 
 		return pp
 
+	@writing
 	def get_next_attachment_id(self):
 		"""
 		Get next attachment ID
 
 		@return string
 		"""
-		next_id = 0
+		self._load_binary_index()
+
+		return str(self._binary_max_id + 1)
+
+	def _load_binary_index(self):
+		"""
+		Build the content hash index of all binaries, unless it already exists
+		"""
+		if self._binary_ids is not None:
+			return
 
-		ids = self.root.xpath("/KeePassFile/Meta/Binaries/Binary/@ID")
+		self._binary_ids = {}
+		self._binary_hashes = {}
+		self._binary_max_id = 0
 
-		for id in ids:
-			if int(id) > next_id:
-				next_id = int(id)
+		for binary in self._get_binaries_node().iterchildren('Binary'):
+			id = binary.get('ID')
+			content = hashlib.sha256()
 
-		return str(next_id + 1)
+			for chunk in self._iter_binary(binary):
+				content.update(chunk)
 
-	def _reset_salsa(self):
+			digest = content.digest()
+
+			# Keep the first binary if contents are duplicated
+			self._binary_ids.setdefault(digest, id)
+			self._binary_hashes[id] = digest
+			self._binary_max_id = max(self._binary_max_id, int(id))
+
+	def _get_binaries_node(self):
 		"""
-		Clear the salsa buffer and reset algorithm
+		Get the Meta/Binaries node, creating it if necessary
+
+		@return Element
 		"""
-		self._salsa_buffer = bytearray()
-		iv = bytes(bytearray.fromhex('e830094b97205d2a'))
-		self.salsa = Salsa20.new(crypto.sha256(self.protected_stream_key), iv)
+		binaries = XPATH_BINARIES(self.root)
+
+		if len(binaries) > 0:
+			return binaries[0]
 
-	def _get_salsa(self, length):
+		return etree.SubElement(XPATH_META(self.root)[0], "Binaries")
+
+	def _get_keystream(self, offset, length):
 		"""
-		Returns the next section of the "random" Salsa20 bytes with the
-		requested `length`
+		Returns the section of the "random" Salsa20 bytes starting
+		at `offset` with the requested `length`
 
+		@param int offset
 		@param int length
-		@return string
+		@return bytearray
 		"""
-		while length > len(self._salsa_buffer):
-			new_salsa = self.salsa.encrypt(bytearray(64))
-			self._salsa_buffer.extend(new_salsa)
-
-		nacho = self._salsa_buffer[:length]
-		del self._salsa_buffer[:length]
-		return nacho
+		return self._keystream.get(offset, length)
 
+	@writing
 	def unprotect(self):
 		"""
 		Find all elements with a 'Protected=True' attribute and replace the text
@@ -156,61 +384,195 @@ class Database:
 		set as 'ProtectedValue' attribute and the 'Protected' attribute is set
 		to 'False'. The 'ProtectPassword' element in the 'Meta' section is also
 		set to 'False'
+
+		All values are collected in document order first and decrypted with
+		a single XOR against the keystream. In lazy mode only the keystream
+		offset of every value is recorded, see reveal()
 		"""
-		self._reset_salsa()
-		self.root.xpath('.//Meta/MemoryProtection/ProtectPassword')[0].text = 'False'
+		XPATH_PROTECT_PASSWORD(self.root)[0].text = 'False'
+		self._protected = {}
+
+		elems = []
+		values = []
+		offset = 0
 
 		for elem in self.root.iterfind('.//Value[@Protected="True"]'):
 			if elem.text is not None:
-				# Remember protected value
-				elem.set('ProtectedValue', elem.text)
+				if self.lazy:
+					# Length of the base64-decoded value
+					length = len(elem.text) * 3 // 4 - elem.text[-2:].count('=')
+					self._protected[elem] = (offset, length)
+					offset += length
+					continue
 
-				# Set protected attribute to false
-				elem.set('Protected', 'False')
+				elems.append(elem)
 
 				# Base64-decode protected value
-				decoded = base64.b64decode(elem.text.encode("utf-8"))
+				values.append(base64.b64decode(elem.text.encode("utf-8")))
+
+		if self.lazy:
+			return
+
+		# Decrypt all values at once
+		encrypted = b''.join(values)
+		decrypted = memoryview(crypto.xor(encrypted, self._get_keystream(0, len(encrypted))))
+
+		offset = 0
+		for elem, value in zip(elems, values):
+			# Remember protected value
+			elem.set('ProtectedValue', elem.text)
 
-				# Decrypt value
-				decrypted = crypto.xor(decoded, self._get_salsa(len(decoded))).decode("utf-8")
+			# Set protected attribute to false
+			elem.set('Protected', 'False')
 
-				# Set value
-				elem.text = decrypted
+			# Set value
+			elem.text = str(decrypted[offset:offset + len(value)], "utf-8")
 
-	def protect(self):
+			offset += len(value)
+
+	def reveal(self, elem):
 		"""
-		Find all elements with a 'Protected=False' attribute and replace the
-		text with a protected value in the XML element tree. If there was a
-		'ProtectedValue' attribute, it is deleted and the 'Protected' attribute
-		is set to 'True'. The 'ProtectPassword' element in the 'Meta' section is
-		also set to 'True'.
+		Decrypt a single protected value in place
+		Does nothing if the value is not protected. The plaintext stays in
+		the tree, so every value is decrypted at most once
 
-		This does not just restore the previous protected value, but reencrypts
-		all text values of elements with 'Protected=False'. So you could use
-		this after modifying a password, adding a completely new entry or
-		deleting entry history items.
+		@param Element elem
 		"""
-		self._reset_salsa()
-		self.root.xpath('.//Meta/MemoryProtection/ProtectPassword')[0].text = 'True'
+		if elem.get('Protected') != 'True' or elem not in self._protected:
+			return
 
-		for elem in self.root.iterfind('.//Value[@Protected="False"]'):
-			if elem.text is not None:
-				# Remove protected value attribute
-				elem.attrib.pop('ProtectedValue', None)
+		with self._reveal_lock:
+			# Revealed by another thread meanwhile
+			if elem.get('Protected') != 'True':
+				return
+
+			offset, length = self._protected[elem]
+
+			# Decrypt value
+			decoded = base64.b64decode(elem.text.encode("utf-8"))
+			decrypted = crypto.xor(decoded, self._get_keystream(offset, length))
+
+			elem.set('ProtectedValue', elem.text)
+			elem.text = decrypted.decode("utf-8")
+			elem.set('Protected', 'False')
+
+	@reading
+	def snapshot(self):
+		"""
+		Export all groups and entries as immutable records
+		The tree is walked once without XPath, protected values are
+		decrypted
+
+		@return Snapshot
+		"""
+		entries = {}
+		groups = {}
+
+		self._snapshot_group(XPATH_ROOT_GROUP(self.root)[0], (), None, entries, groups)
+
+		return Snapshot(entries, groups)
+
+	def iter_records(self):
+		"""
+		Yield records of all entries, group by group in depth-first order
+		Unlike snapshot() only one record exists at a time
+
+		@return generator[EntryRecord]
+		"""
+		for group in self.iter_groups():
+			path = group.get_path()
+
+			for entry_xml in group.get_xml().iterchildren('Entry'):
+				yield self._snapshot_entry(entry_xml, path)
+
+	def _snapshot_group(self, xml, parent_path, parent_id, entries, groups):
+		"""
+		Add records of a group, its entries and subgroups
+
+		@param Element xml
+		@param tuple[string] parent_path
+		@param string parent_id
+		@param dict entries
+		@param dict groups
+		@return string Group ID
+		"""
+		id = None
+		name = None
+		entry_xmls = []
+		group_xmls = []
 
-				# Set protected to true
-				elem.set('Protected', 'True')
+		for child in xml:
+			if child.tag == 'UUID':
+				id = child.text
+			elif child.tag == 'Name':
+				name = child.text or ''
+			elif child.tag == 'Entry':
+				entry_xmls.append(child)
+			elif child.tag == 'Group':
+				group_xmls.append(child)
 
-				# Encrypt value
-				value_utf8 = elem.text.encode("utf-8")
-				encrypted = crypto.xor(value_utf8, self._get_salsa(len(value_utf8)))
+		path = parent_path + (name,)
 
-				# Base64-encode encrypted value
-				encoded = base64.b64encode(encrypted).decode("utf-8")
+		# Reserve position, so groups stay in document order
+		groups[id] = None
 
-				# Set value
-				elem.text = encoded
+		entry_ids = []
 
+		for entry_xml in entry_xmls:
+			entry = self._snapshot_entry(entry_xml, path)
+			entries[entry.id] = entry
+			entry_ids.append(entry.id)
+
+		group_ids = [self._snapshot_group(group_xml, path, id, entries, groups) for group_xml in group_xmls]
+
+		groups[id] = GroupRecord(id, name, path, parent_id, tuple(entry_ids), tuple(group_ids))
+
+		return id
+
+	def _snapshot_entry(self, xml, path):
+		"""
+		Get record of an entry
+
+		@param Element xml
+		@param tuple[string] path
+		@return EntryRecord
+		"""
+		id = None
+		tags = None
+		fields = {}
+		attachments = []
+		protected = []
+
+		for child in xml:
+			if child.tag == 'UUID':
+				id = child.text
+			elif child.tag == 'Tags':
+				tags = child.text
+			elif child.tag == 'String' or child.tag == 'Binary':
+				key = None
+				value = None
+
+				for item in child:
+					if item.tag == 'Key':
+						key = item.text
+					elif item.tag == 'Value':
+						value = item
+
+				if key is None or value is None:
+					continue
+
+				if child.tag == 'String':
+					self.reveal(value)
+					fields[key] = value.text
+
+					if value.get('Protected') is not None:
+						protected.append(key)
+				else:
+					attachments.append((key, value.get('Ref')))
+
+		return EntryRecord(id, path, fields, tags, tuple(attachments), protected)
+
+	@reading
 	def get_groups(self):
 		"""
 		Extract all groups
@@ -218,24 +580,357 @@ class Database:
 		@return list[Group]
 		"""
 		groups = []
-		for dom_group in self.root.xpath('./Root/Group/Group'):
-			groups.append(Group.fromxml(dom_group))
+		for dom_group in XPATH_GROUPS(self.root):
+			groups.append(Group.fromxml(dom_group, self))
 
 		return groups
 
-	def add_group(self, name):
+	@reading
+	def get_root_group(self):
+		"""
+		Get the top level group
+
+		@return Group
+		"""
+		return Group.fromxml(XPATH_ROOT_GROUP(self.root)[0], self)
+
+	def iter_groups(self, order='depth', start=None):
+		"""
+		Iterate over the whole group tree, or the subtree of `start`
+		Groups are visited depth-first (pre-order) or breadth-first,
+		the starting group first
+
+		@param string order 'depth' or 'breadth'
+		@param Group start Defaults to the root group
+		@return generator[Group]
+		"""
+		if order not in ('depth', 'breadth'):
+			raise Exception("Unknown order")
+
+		start = start.get_xml() if start is not None else XPATH_ROOT_GROUP(self.root)[0]
+		pending = deque([start])
+
+		while pending:
+			if order == 'depth':
+				xml = pending.pop()
+				pending.extend(reversed(list(xml.iterchildren('Group'))))
+			else:
+				xml = pending.popleft()
+				pending.extend(xml.iterchildren('Group'))
+
+			yield Group.fromxml(xml, self)
+
+	@reading
+	def get_group_by_path(self, path):
+		"""
+		Get group by the names of the group and all enclosing groups,
+		starting at the root group. If names are not unique, the first
+		group in document order is returned
+
+		@param tuple[string] path Sequence of names or '/'-separated string
+		@return Group
+		"""
+		if isinstance(path, str):
+			path = path.strip('/').split('/')
+
+		group_paths = self._group_paths
+
+		if group_paths is None:
+			# Built completely before it's shared with other readers
+			group_paths = {}
+			self._index_group_paths(XPATH_ROOT_GROUP(self.root)[0], (), group_paths)
+			self._group_paths = group_paths
+
+		xml = group_paths.get(tuple(path))
+
+		return Group.fromxml(xml, self) if xml is not None else None
+
+	def _index_group_paths(self, xml, parent_path, group_paths):
+		"""
+		Add paths of a group and its subgroups to a path index
+
+		@param Element xml
+		@param tuple[string] parent_path
+		@param dict group_paths
+		"""
+		path = parent_path + (xml.findtext('Name'),)
+		group_paths.setdefault(path, xml)
+
+		for child in xml.iterchildren('Group'):
+			self._index_group_paths(child, path, group_paths)
+
+	@modifying
+	def move_group(self, group, parent):
+		"""
+		Move group including its entries and subgroups into another group
+
+		@param Group group
+		@param Group parent
+		"""
+		xml = group.get_xml()
+		target = parent.get_xml()
+
+		# Refuse to move a group into its own subtree
+		ancestor = target
+		while ancestor is not None:
+			if ancestor is xml:
+				raise Exception("Cannot move group into itself")
+			ancestor = ancestor.getparent()
+
+		target.append(xml)
+
+		location_changed = xml.find('Times/LocationChanged')
+
+		if location_changed is not None:
+			location_changed.text = datetime.datetime.utcnow().isoformat()
+
+		self._group_paths = None
+
+	@modifying
+	def add_group(self, name, parent=None):
 		"""
 		Add new group
 
 		@param string name
+		@param Group parent Defaults to the root group
 		@return int
 		"""
-		groups = self.root.xpath('./Root/Group')[0]
+		groups = parent.get_xml() if parent is not None else XPATH_ROOT_GROUP(self.root)[0]
 		group = Group.create(name)
+		group.database = self
 		groups.append(group.get_xml())
 
+		self.index_add(group.get_xml())
+
 		return group.get_id()
 
+	@modifying
+	def bulk_import(self, entries, group=None):
+		"""
+		Add many entries at once, see Group.add_entries
+
+		@param iterable[dict] entries
+		@param Group group Defaults to the root group
+		@return list[string] IDs of the new entries
+		"""
+		group = group if group is not None else self.get_root_group()
+
+		return group.add_entries(entries)
+
+	@modifying
+	def remove_group(self, group):
+		"""
+		Remove group including its entries and subgroups
+
+		@param Group group
+		"""
+		xml = group.get_xml()
+		xml.getparent().remove(xml)
+
+		self.index_remove(xml)
+
+	def index_add(self, xml):
+		"""
+		Add all entries and groups in a subtree to the index
+		History entries are skipped for lookups, but their attachments
+		are counted as references
+
+		@param Element xml
+		"""
+		self.index_add_many((xml,))
+
+	@modifying
+	def index_add_many(self, xmls):
+		"""
+		Add several subtrees to the index as a single change
+
+		@param iterable[Element] xmls
+		"""
+		for xml in xmls:
+			for elem in xml.iter('Entry', 'Group', 'Binary'):
+				if elem.tag == 'Binary':
+					ref = elem.find('Value')
+
+					if ref is not None and ref.get('Ref') is not None:
+						self._binary_refs[ref.get('Ref')].add(elem)
+				elif elem.tag == 'Group':
+					self.index.add_group(elem.findtext('UUID'), elem)
+					self._group_paths = None
+				elif elem.getparent() is None or elem.getparent().tag != 'History':
+					self._index_entry(elem)
+
+	def _index_entry(self, xml):
+		"""
+		Add a single entry to the index
+		Fields are read from the element directly, opening thousands of
+		entries shouldn't pay for an Entry object each
+
+		@param Element xml
+		"""
+		id = None
+		title = None
+		url = None
+
+		for child in xml:
+			if child.tag == 'UUID':
+				id = child.text
+			elif child.tag == 'String':
+				key, value = self._read_string(child)
+
+				if value is None or (key != 'Title' and key != 'URL'):
+					continue
+
+				self.reveal(value)
+
+				if key == 'Title':
+					title = value.text
+				else:
+					url = value.text
+
+		self.index.add_entry(id, xml, title, url)
+
+		if self.search_index is not None:
+			self.search_index.add(id, self._search_fields(xml))
+
+	def _search_fields(self, xml):
+		"""
+		Get the fields of an entry to search in
+		Protected fields are left out
+
+		@param Element xml
+		@return dict {key: value}
+		"""
+		fields = {}
+
+		for child in xml:
+			if child.tag == 'Tags':
+				fields['Tags'] = child.text
+			elif child.tag == 'String':
+				key, value = self._read_string(child)
+
+				if value is not None and value.get('Protected') is None:
+					fields[key] = value.text
+
+		return fields
+
+	def _read_string(self, xml):
+		"""
+		Get key and value element of a string field
+		Cheaper than find(), which goes through ElementPath
+
+		@param Element xml
+		@return (string, Element)
+		"""
+		key = None
+		value = None
+
+		for child in xml:
+			if child.tag == 'Key':
+				key = child.text
+			elif child.tag == 'Value':
+				value = child
+
+		return key, value
+
+	def _get_search_index(self):
+		"""
+		Get the search index, building it on first use
+
+		@return SearchIndex
+		"""
+		if self.search_index is None:
+			search_index = SearchIndex()
+
+			for id, xml in self.index.entries.items():
+				search_index.add(id, self._search_fields(xml))
+
+			self.search_index = search_index
+
+		return self.search_index
+
+	@modifying
+	def index_remove(self, xml):
+		"""
+		Remove all entries and groups in a subtree from the index
+
+		@param Element xml
+		"""
+		for elem in xml.iter('Binary'):
+			ref = elem.find('Value')
+
+			if ref is not None and ref.get('Ref') in self._binary_refs:
+				self._binary_refs[ref.get('Ref')].discard(elem)
+
+		for elem in xml.iter('Entry', 'Group'):
+			if elem.tag == 'Group':
+				self.index.remove_group(elem.findtext('UUID'))
+				self._group_paths = None
+			elif elem.getparent() is None or elem.getparent().tag != 'History':
+				self.index.remove_entry(elem.findtext('UUID'))
+
+				if self.search_index is not None:
+					self.search_index.remove(elem.findtext('UUID'))
+
+	@reading
+	def get_entry(self, id):
+		"""
+		Get entry by UUID
+
+		@param string id
+		@return Entry
+		"""
+		xml = self.index.entries.get(id)
+
+		return Entry.fromxml(xml, self) if xml is not None else None
+
+	@reading
+	def get_group(self, id):
+		"""
+		Get group by UUID
+
+		@param string id
+		@return Group
+		"""
+		xml = self.index.groups.get(id)
+
+		return Group.fromxml(xml, self) if xml is not None else None
+
+	@reading
+	def search(self, query, limit=None, fuzzy=False):
+		"""
+		Search entries in title, username, URL, notes, tags and custom
+		string fields. Protected fields are not searched. The search index
+		is built on the first search
+
+		@param string query
+		@param int limit Maximum number of results
+		@param bool fuzzy Also match entries containing most of a word
+		@return list[Entry] Best match first
+		"""
+		return [self.get_entry(id) for id, score in self._get_search_index().search(query, limit, fuzzy)]
+
+	@reading
+	def find_entries_by_title(self, title):
+		"""
+		Get entries by title, ignoring case and surrounding whitespace
+
+		@param string title
+		@return list[Entry]
+		"""
+		return [self.get_entry(id) for id in self.index.find_by_title(title)]
+
+	@reading
+	def find_entries_by_host(self, host):
+		"""
+		Get entries by the host of their URL
+		Accepts a host name or a complete URL
+
+		@param string host
+		@return list[Entry]
+		"""
+		return [self.get_entry(id) for id in self.index.find_by_host(host)]
+
+	@reading
 	def get_attachment(self, id):
 		"""
 		Get attachment content
@@ -243,13 +938,93 @@ class Database:
 		@param string id
 		@return string
 		"""
-		attachment = self.root.xpath('/KeePassFile/Meta/Binaries/Binary[@ID={}]'.format(id))
+		attachment = XPATH_BINARY(self.root, id=str(id))
 
 		if len(attachment) > 0:
 			return attachment[0].text
 		else:
 			return ""
 
+	def _iter_binary(self, binary):
+		"""
+		Decode binary content in chunks, inflating compressed binaries
+
+		@param Element binary
+		@return generator[bytes]
+		"""
+		chunks = streams.iter_b64decode(binary.text or "")
+
+		if binary.get('Compressed') == 'True':
+			chunks = streams.iter_gunzip(chunks)
+
+		return chunks
+
+	def open_attachment(self, id):
+		"""
+		Open attachment content as readable stream
+		Content is decoded and inflated chunk by chunk while reading
+
+		@param string id
+		@return IterReader
+		"""
+		binary = XPATH_BINARY(self.root, id=str(id))
+
+		if len(binary) < 1:
+			raise Exception("Attachment does not exist")
+
+		return streams.IterReader(self._iter_binary(binary[0]))
+
+	@reading
+	def save_attachment(self, id, path):
+		"""
+		Write attachment content to a file
+
+		@param string id
+		@param string path
+		"""
+		with self.open_attachment(id) as reader, open(path, 'wb') as out:
+			shutil.copyfileobj(reader, out, streams.BLOCK_SIZE)
+
+	@modifying
+	def add_attachment_from_path(self, path, compress=False):
+		"""
+		Add attachment to database from a file
+		The file is read in chunks, hashed first and only encoded if its
+		content is not in the database yet
+
+		@param string path
+		@param bool compress Store content gzip compressed
+		@return string
+		"""
+		if not os.path.isfile(path):
+			raise Exception("File does not exist")
+
+		self._load_binary_index()
+
+		# Check if content exists
+		digest = hashlib.sha256()
+
+		with open(path, 'rb') as f_in:
+			for chunk in streams.iter_file(f_in):
+				digest.update(chunk)
+
+		digest = digest.digest()
+
+		if digest in self._binary_ids:
+			return self._binary_ids[digest]
+
+		# Encode content in chunks
+		with open(path, 'rb') as f_in:
+			chunks = streams.iter_file(f_in)
+
+			if compress:
+				chunks = streams.iter_gzip(chunks)
+
+			encoded = "".join(streams.iter_b64encode(chunks))
+
+		return self._add_binary(digest, encoded, compress)
+
+	@modifying
 	def add_attachment(self, content):
 		"""
 		Add attachment to database
@@ -257,32 +1032,59 @@ class Database:
 		@param bytes content
 		@return string
 		"""
-		# Encode content
-		encoded = base64.b64encode(content).decode("utf-8")
-
-		# Get attachments parent node
-		node_binaries = self.root.xpath("/KeePassFile/Meta/Binaries")[0]
+		self._load_binary_index()
 
 		# Check if content exists
-		exists = node_binaries.xpath("./Binary[text()=\"{}\"]".format(encoded))
+		digest = hashlib.sha256(content).digest()
 
-		if len(exists):
+		if digest in self._binary_ids:
 			# Attachment already exists, just get the reference ID
-			next_id = exists[0].get('ID')
-		else:
-			# Attachment does not exist yet, create it
-			next_id = self.get_next_attachment_id()
+			return self._binary_ids[digest]
+
+		# Attachment does not exist yet, create it
+		return self._add_binary(digest, base64.b64encode(content).decode("utf-8"))
+
+	def _add_binary(self, digest, encoded, compressed=False):
+		"""
+		Create binary node
+
+		@param bytes digest SHA256 of the content
+		@param string encoded Base64-encoded content
+		@param bool compressed Whether the content is gzip compressed
+		@return string
+		"""
+		next_id = self.get_next_attachment_id()
+
+		# Create attachment node
+		binary = etree.Element("Binary")
+		binary.set("ID", next_id)
 
-			# Create attachment node
-			binary = etree.Element("Binary")
-			binary.set("ID", next_id)
-			binary.text = encoded
+		if compressed:
+			binary.set("Compressed", "True")
 
-			# Add attachment to database
-			node_binaries.append(binary)
+		binary.text = encoded
+
+		# Add attachment to database
+		self._get_binaries_node().append(binary)
+
+		self._binary_ids[digest] = next_id
+		self._binary_hashes[next_id] = digest
+		self._binary_max_id = int(next_id)
 
 		return next_id
 
+	@modifying
+	def add_attachments(self, contents):
+		"""
+		Add multiple attachments to database
+		Identical contents share one binary
+
+		@param iterable[bytes] contents
+		@return list[string] IDs in the order of the contents
+		"""
+		return [self.add_attachment(content) for content in contents]
+
+	@modifying
 	def remove_attachment(self, attachment):
 		"""
 		Remove attachment
@@ -290,9 +1092,92 @@ class Database:
 		@param Attachment attachment
 		"""
 		# Is the attachment used anywhere else?
-		used = self.root.xpath('//Binary/Value[@Ref="{}"]'.format(attachment.get_id()))
+		used = self._binary_refs.get(attachment.get_id(), set()) - {attachment.get_xml()}
 
-		if len(used) == 1:
+		if not used:
 			# Remove attachment from database
-			node_binary = self.root.xpath('/KeePassFile/Meta/Binaries/Binary[@ID="{}"]'.format(attachment.get_id()))[0]
+			self._remove_binary(attachment.get_id())
+
+	def _remove_binary(self, id):
+		"""
+		Remove binary from database
+
+		@param string id
+		"""
+		for node_binary in XPATH_BINARY(self.root, id=id):
 			node_binary.getparent().remove(node_binary)
+
+		self._binary_refs.pop(id, None)
+
+		if self._binary_hashes is not None:
+			digest = self._binary_hashes.pop(id, None)
+
+			if self._binary_ids.get(digest) == id:
+				# Point to another binary with the same content, if any
+				survivor = next((other for other, other_digest in self._binary_hashes.items() if other_digest == digest), None)
+
+				if survivor is not None:
+					self._binary_ids[digest] = survivor
+				else:
+					del self._binary_ids[digest]
+
+	@reading
+	def get_attachment_refs(self, id):
+		"""
+		Get number of attachments referencing a binary, including history
+
+		@param string id
+		@return int
+		"""
+		return len(self._binary_refs.get(str(id), ()))
+
+	@modifying
+	def collect_garbage(self):
+		"""
+		Remove all binaries no attachment refers to
+
+		@return list[string] IDs of the removed binaries
+		"""
+		removed = []
+
+		for binary in list(self._get_binaries_node().iterchildren('Binary')):
+			id = binary.get('ID')
+
+			if not self._binary_refs.get(id):
+				self._remove_binary(id)
+				removed.append(id)
+
+		return removed
+
+	@modifying
+	def compact(self):
+		"""
+		Remove unused binaries and renumber the remaining ones densely,
+		starting at 0. References are updated accordingly
+
+		@return dict {old ID: new ID}
+		"""
+		self.collect_garbage()
+
+		mapping = {}
+		refs = defaultdict(set)
+
+		for new_id, binary in enumerate(self._get_binaries_node().iterchildren('Binary')):
+			old_id = binary.get('ID')
+			new_id = str(new_id)
+
+			mapping[old_id] = new_id
+			binary.set('ID', new_id)
+
+			for elem in self._binary_refs.get(old_id, ()):
+				elem.find('Value').set('Ref', new_id)
+
+			refs[new_id] = self._binary_refs.get(old_id, set())
+
+		self._binary_refs = refs
+
+		# Hash index is rebuilt on next use
+		self._binary_ids = None
+		self._binary_hashes = None
+
+		return mapping
@@ -2,96 +2,168 @@ import base64
 import hashlib
 import uuid
 import datetime
+import copy
 
 from lxml import etree
 
 from . import util
 from .attachment import Attachment
+from .lock import NULL_LOCK, reading, writing
+
+XPATH_ATTACHMENTS = etree.XPath('./Binary')
+XPATH_ATTACHMENT = etree.XPath('./Binary[Key = $filename][Value[@Ref = $id]]')
+
+# Times set to the creation time of new entries
+TIMES = ('CreationTime', 'LastModificationTime', 'LastAccessTime', 'ExpiryTime', 'LocationChanged')
 
 class Entry:
-	def __init__(self, xml):
+	# Element new entries are cloned from
+	_template = None
+
+	def __init__(self, xml, database=None):
 		"""
 		Constructor
 
 		@param ElementTree xml
+		@param Database database Database the entry belongs to
 		"""
 		self.xml = xml
+		self.database = database
+
+		# String field values by key, built on first access
+		self._fields = None
 
 	@classmethod
-	def fromxml(cls, xml):
+	def fromxml(cls, xml, database=None):
 		"""
 		Parse entry from xml
 		Wrapper for the constructor, acts as syntactic sugar
 		to describe the purpose of this constructing method better
 
 		@param ElementTree xml
+		@param Database database
 		"""
-		return cls(xml)
+		return cls(xml, database)
+
+	@classmethod
+	def get_template(cls):
+		"""
+		Get the element new entries are cloned from
+		Built once on first use
+
+		@return ElementTree
+		"""
+		if cls._template is None:
+			entry = {
+				'UUID': None,
+				'IconID': 0,
+				'ForegroundColor': None,
+				'BackgroundColor': None,
+				'OverrideURL': None,
+				'Tags': None,
+				'Times': {
+					'CreationTime': None,
+					'LastModificationTime': None,
+					'LastAccessTime': None,
+					'ExpiryTime': None,
+					'Expires': 'False',
+					'UsageCount': 1,
+					'LocationChanged': None
+				},
+				'String': [
+					{
+						'Key': 'Notes',
+						'Value': None,
+					},
+					{
+						'Key': 'Title',
+						'Value': None,
+					},
+					{
+						'Key': 'UserName',
+						'Value': None,
+					},
+					{
+						'Key': 'Password',
+						'Value': None,
+					},
+					{
+						'Key': 'URL',
+						'Value': None,
+					}
+				],
+				'AutoType': {
+					'Enabled': 'True',
+					'DataTransferObfuscation': 0
+				},
+				'History': None
+			}
+
+			xml = util.dict_to_xml("Entry", entry)
+			cls(xml).get_fields()['Password'].set('Protected', 'False')
+
+			cls._template = xml
+
+		return cls._template
 
 	@classmethod
-	def create(cls, title, username=None, password=None, url=None, notes=None):
+	def create(cls, title, username=None, password=None, url=None, notes=None, tags=None, fields=None, now=None):
 		"""
 		Create new entry
+		The entry is cloned from the template and its fields are filled in
+		directly
 
 		@param string title
 		@param string username
 		@param string password
 		@param string url
 		@param string notes
+		@param string tags
+		@param dict fields Custom string fields {key: value}
+		@param string now Timestamp of all times, defaults to the current time
 		"""
 		id = base64.b64encode(uuid.uuid1().bytes).decode('utf-8')
-		now = datetime.datetime.utcnow().isoformat()
-
-		entry = {
-			'UUID': id,
-			'IconID': 0,
-			'ForegroundColor': None,
-			'BackgroundColor': None,
-			'OverrideURL': None,
-			'Tags': None,
-			'Times': {
-				'CreationTime': now,
-				'LastModificationTime': now,
-				'LastAccessTime': now,
-				'ExpiryTime': now,
-				'Expires': 'False',
-				'UsageCount': 1,
-				'LocationChanged': now
-			},
-			'String': [
-				{
-					'Key': 'Notes',
-					'Value': None,
-				},
-				{
-					'Key': 'Title',
-					'Value': title,
-				},
-				{
-					'Key': 'UserName',
-					'Value': username,
-				},
-				{
-					'Key': 'Password',
-					'Value': password,
-				},
-				{
-					'Key': 'URL',
-					'Value': url,
-				}
-			],
-			'AutoType': {
-				'Enabled': 'True',
-				'DataTransferObfuscation': 0
-			},
-			'History': None
+
+		if now is None:
+			now = datetime.datetime.utcnow().isoformat()
+
+		values = {
+			'Notes': notes,
+			'Title': title,
+			'UserName': username,
+			'Password': password,
+			'URL': url
 		}
 
-		xml = util.dict_to_xml("Entry", entry)
-		xml.xpath('./String[Key = "Password"]/Value')[0].set('Protected', 'False')
+		xml = copy.deepcopy(cls.get_template())
+
+		for child in xml:
+			if child.tag == 'UUID':
+				child.text = id
+			elif child.tag == 'Tags':
+				child.text = str(tags) if tags is not None else None
+			elif child.tag == 'Times':
+				for time in child:
+					if time.tag in TIMES:
+						time.text = now
+			elif child.tag == 'String':
+				# Template strings consist of Key and Value
+				value = values.get(child[0].text)
+				child[1].text = str(value) if value is not None else None
+			elif child.tag == 'AutoType' and fields:
+				# Custom strings follow the standard ones
+				for key, value in fields.items():
+					string = etree.Element('String')
+					etree.SubElement(string, 'Key').text = key
+					etree.SubElement(string, 'Value').text = str(value) if value is not None else None
+					child.addprevious(string)
 
 		return cls(xml)
 
+	@property
+	def lock(self):
+		return self.database.lock if self.database is not None else NULL_LOCK
+
 	def get_xml(self):
 		"""
 		Get the XML-representation of the entry
@@ -106,7 +178,97 @@ class Entry:
 
 		@return string
 		"""
-		return self.xml.xpath('./UUID')[0].text
+		return self.xml.findtext('UUID')
+
+	@reading
+	def get_fields(self):
+		"""
+		Get the value elements of all string fields
+		The map is built in one pass over the children and cached
+
+		@return dict {key: Element}
+		"""
+		if self._fields is None:
+			fields = {}
+
+			for string in self.xml.iterchildren('String'):
+				key = None
+				value = None
+
+				for child in string:
+					if child.tag == 'Key':
+						key = child.text
+					elif child.tag == 'Value':
+						value = child
+
+				if key is not None and value is not None:
+					fields[key] = value
+
+			self._fields = fields
+
+		return self._fields
+
+	@reading
+	def get_field(self, key):
+		"""
+		Get value of a string field
+		Protected values are decrypted on first access
+
+		@param string key
+		@return string
+		"""
+		value = self.get_fields().get(key)
+
+		if value is None:
+			return None
+
+		if self.database is not None:
+			self.database.reveal(value)
+
+		return value.text
+
+	@reading
+	def get_strings(self):
+		"""
+		Get all string fields that are not protected
+
+		@return dict {key: value}
+		"""
+		strings = {}
+
+		for key, value in self.get_fields().items():
+			if value.get('Protected') is None:
+				strings[key] = value.text
+
+		return strings
+
+	@writing
+	def set_field(self, key, value, protected=False):
+		"""
+		Set value of a string field, creating the field if necessary
+
+		@param string key
+		@param string value
+		@param bool protected Whether the value is protected when saving
+		"""
+		elem = self.get_fields().get(key)
+
+		if elem is None:
+			string = etree.SubElement(self.xml, 'String')
+			etree.SubElement(string, 'Key').text = key
+			elem = etree.SubElement(string, 'Value')
+
+			# Field map is outdated
+			self._fields = None
+
+		elem.text = value
+		elem.attrib.pop('ProtectedValue', None)
+
+		if protected or elem.get('Protected') is not None:
+			elem.set('Protected', 'False')
+
+		if self.database is not None:
+			self.database.index_add(self.xml)
 
 	def get_title(self):
 		"""
@@ -114,7 +276,7 @@ class Entry:
 
 		@return string
 		"""
-		return self.xml.xpath('./String[Key = "Title"]/Value')[0].text
+		return self.get_field("Title")
 
 	def get_notes(self):
 		"""
@@ -122,7 +284,7 @@ class Entry:
 
 		@return string
 		"""
-		return self.xml.xpath('./String[Key = "Notes"]/Value')[0].text
+		return self.get_field("Notes")
 
 	def get_username(self):
 		"""
@@ -130,7 +292,7 @@ class Entry:
 
 		@return string
 		"""
-		return self.xml.xpath('./String[Key = "Username"]/Value')[0].text
+		return self.get_field("UserName")
 
 	def get_password(self):
 		"""
@@ -138,7 +300,7 @@ class Entry:
 
 		@return string
 		"""
-		return self.xml.xpath('./String[Key = "Password"]/Value')[0].text
+		return self.get_field("Password")
 
 	def get_url(self):
 		"""
@@ -146,8 +308,58 @@ class Entry:
 
 		@return string
 		"""
-		return self.xml.xpath('./String[Key = "URL"]/Value')[0].text
+		return self.get_field("URL")
+
+	@reading
+	def get_tags(self):
+		"""
+		Get tags
+
+		@return string
+		"""
+		return self.xml.findtext('Tags')
+
+	def set_title(self, title):
+		"""
+		Set title
+
+		@param string title
+		"""
+		self.set_field("Title", title)
+
+	def set_username(self, username):
+		"""
+		Set username
+
+		@param string username
+		"""
+		self.set_field("UserName", username)
+
+	def set_password(self, password):
+		"""
+		Set password
+
+		@param string password
+		"""
+		self.set_field("Password", password, True)
+
+	def set_url(self, url):
+		"""
+		Set URL
 
+		@param string url
+		"""
+		self.set_field("URL", url)
+
+	def set_notes(self, notes):
+		"""
+		Set notes
+
+		@param string notes
+		"""
+		self.set_field("Notes", notes)
+
+	@reading
 	def get_attachments(self):
 		"""
 		Get attachments
@@ -156,11 +368,12 @@ class Entry:
 		"""
 		attachments = []
 
-		for attachment_xml in self.xml.xpath('./Binary'):
+		for attachment_xml in XPATH_ATTACHMENTS(self.xml):
 			attachments.append(Attachment.fromxml(attachment_xml))
 
 		return attachments
 
+	@writing
 	def add_attachment(self, filename, id):
 		"""
 		Add attachment
@@ -171,12 +384,18 @@ class Entry:
 		attachment = Attachment.create(id, filename)
 		self.xml.append(attachment.get_xml())
 
+		if self.database is not None:
+			self.database.index_add(attachment.get_xml())
+
+	@writing
 	def remove_attachment(self, attachment):
 		"""
 		Remove attachment
 
 		@param Attachment attachment
 		"""
-
-		attachment = self.xml.xpath('./Binary[Key="{}"][Value[@Ref="{}"]]'.format(attachment.get_filename(), attachment.get_id()))[0]
+		attachment = XPATH_ATTACHMENT(self.xml, filename=attachment.get_filename(), id=attachment.get_id())[0]
 		attachment.getparent().remove(attachment)
+
+		if self.database is not None:
+			self.database.index_remove(attachment)
@@ -0,0 +1,98 @@
+import csv
+import json
+
+# Entry keys -> column names, in column order
+COLUMNS = (
+	('Title', 'title'),
+	('UserName', 'username'),
+	('Password', 'password'),
+	('URL', 'url'),
+	('Notes', 'notes'),
+)
+
+def export(records, file, format='json', include_passwords=False):
+	"""
+	Export entries as JSON Lines or CSV
+
+	@param iterable[EntryRecord] records
+	@param file file Text stream
+	@param string format 'json' or 'csv'
+	@param bool include_passwords Also write protected fields in plaintext
+	@return int Number of exported entries
+	"""
+	if format == 'json':
+		return export_json(records, file, include_passwords)
+	elif format == 'csv':
+		return export_csv(records, file, include_passwords)
+	else:
+		raise Exception("Unknown export format: " + format)
+
+def export_json(records, file, include_passwords=False):
+	"""
+	Export entries as JSON Lines, one object per entry
+	Records are written as they come, so exporting from File.iter_entries
+	keeps memory flat. Custom string fields are kept under their own key.
+
+	@param iterable[EntryRecord] records
+	@param file file Text stream
+	@param bool include_passwords Also write protected fields in plaintext
+	@return int Number of exported entries
+	"""
+	count = 0
+
+	for record in records:
+		file.write(json.dumps(row(record, include_passwords), ensure_ascii=False))
+		file.write("\n")
+		count += 1
+
+	return count
+
+def export_csv(records, file, include_passwords=False, fields=()):
+	"""
+	Export entries as CSV with a header row
+	Only the standard columns and the custom string fields named in
+	`fields` are written, as the header can't be changed once written.
+
+	@param iterable[EntryRecord] records
+	@param file file Text stream
+	@param bool include_passwords Also write protected fields in plaintext
+	@param iterable[string] fields Custom string fields to export
+	@return int Number of exported entries
+	"""
+	columns = ['group'] + [column for key, column in COLUMNS] + ['tags'] + list(fields)
+
+	if not include_passwords:
+		columns.remove('password')
+
+	writer = csv.DictWriter(file, columns, extrasaction='ignore')
+	writer.writeheader()
+	count = 0
+
+	for record in records:
+		writer.writerow(row(record, include_passwords))
+		count += 1
+
+	return count
+
+def row(record, include_passwords=False):
+	"""
+	Map an entry to column names as understood by the importer
+	The group path is relative to the root group
+
+	@param EntryRecord record
+	@param bool include_passwords Keep protected fields
+	@return dict
+	"""
+	names = dict(COLUMNS)
+	result = {'group': "/".join(record.group_path[1:])}
+
+	for key, value in zip(record.keys, record.values):
+		if key in record.protected and not include_passwords:
+			continue
+
+		result[names.get(key, key)] = value if value is not None else ""
+
+	if record.tags:
+		result['tags'] = record.tags
+
+	return result
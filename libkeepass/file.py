@@ -3,16 +3,18 @@
 # https://github.com/libkeepass/libkeepass/blob/master/libkeepass/kdb4.py -> cipher IDs
 
 import os
-from Crypto.Cipher import AES
+import mmap
 import struct
-import io
 import base64
 
 import hashlib
 
 from . import crypto
-from .header import Header
+from . import streams
+from . import transform
+from .header import Header, COMPRESSION_NONE, COMPRESSION_GZIP
 from .database import Database
+from .reader import ReadOnlyDatabase
 
 KDB4_SIGNATURE = (0x9AA2D903, 0xB54BFB67)
 
@@ -22,38 +24,180 @@ class File:
 	passphrase = ""
 	master_key = None
 	database = None
-
-	def __init__(self, path, passphrase):
+	transform_backend = None
+	key_cache = None
+
+	def __init__(self, path, passphrase, key_cache=None, use_mmap=False, concurrent=False):
+		"""
+		Constructor
+
+		@param string path
+		@param string passphrase
+		@param KeyCache key_cache Optional cache of transformed keys
+		@param bool use_mmap Read the file through a memory map
+		@param bool concurrent Open databases for use by several threads
+		"""
 		self.path = path
 		self.passphrase = passphrase
+		self.key_cache = key_cache
+		self.use_mmap = use_mmap
+		self.concurrent = concurrent
+
+		# Event cancelling the key transformation once set
+		self.cancel = None
 
-	def open(self):
-		encrypted = ""
+	def open(self, lazy=False):
+		"""
+		Open and decrypt the database
 
+		@param bool lazy Only decrypt protected values when they are accessed
+		@return Database
+		"""
 		with open(self.path, "rb") as f_in:
+			if self.use_mmap:
+				return self.open_buffer(f_in, lazy)
+
+			self.read_header(f_in)
+
+			# Decrypt and extract database while reading
+			return self.load(f_in, lazy)
+
+	def iter_entries(self):
+		"""
+		Stream all entries out of the file without building the database
+		The file stays open until iteration is finished
+
+		@return generator[EntryRecord]
+		"""
+		with open(self.path, "rb") as f_in:
+			self.read_header(f_in)
+
+			# Generate master key
+			self.master_key = self.generate_master_key()
+
+			database = ReadOnlyDatabase(
+				self.decrypt_stream(f_in),
+				self.header.get('protected_stream_key'),
+				self.is_compressed()
+			)
+
+			yield from database.iter_entries()
+
+	def read_header(self, f_in):
+		"""
+		Read signature, version and header
+
+		@param file f_in
+		"""
+		# Extract signature (2 * 4 bytes)
+		self.signature = struct.unpack('<II', f_in.read(8))
+
+		if self.signature != KDB4_SIGNATURE:
+			raise Exception("Signature does not match")
+
+		# Extract version (2 * 2 bytes) -> (minor, major)
+		self.version = struct.unpack('<hh', f_in.read(4))
+
+		# Extract header
+		self.header = Header(f_in)
+
+	def decrypt_payload(self):
+		"""
+		Decrypt the database XML without parsing it
+		Covers all the CPU-bound work of open() but the parsing, see
+		load_xml() for building the database from the result
+
+		@return bytes
+		"""
+		with open(self.path, "rb") as f_in:
+			self.read_header(f_in)
+
+			# Generate master key
+			self.master_key = self.generate_master_key()
+
+			chunks = streams.iter_hashed_blocks(self.decrypt_stream(f_in))
+
+			if self.is_compressed():
+				chunks = streams.iter_gunzip(chunks)
+
+			return b''.join(chunks)
+
+	def load_xml(self, xml, lazy=False):
+		"""
+		Build the database from XML returned by decrypt_payload()
+
+		@param bytes xml
+		@param bool lazy Only decrypt protected values when they are accessed
+		@return Database
+		"""
+		self.database = Database.fromxml(
+			xml,
+			self.header.get('protected_stream_key'),
+			self.is_compressed(),
+			lazy,
+			self.concurrent
+		)
+
+		return self.database
+
+	def open_buffer(self, f_in, lazy=False):
+		"""
+		Open and decrypt the database through a memory map
+		The header is parsed at offsets and the encrypted data is passed
+		on as memoryview without intermediate copies
+
+		@param file f_in
+		@param bool lazy
+		@return Database
+		"""
+		mapped = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+
+		try:
+			buffer = memoryview(mapped)
+
 			# Extract signature (2 * 4 bytes)
-			self.signature = struct.unpack('<II', f_in.read(8))
+			self.signature = struct.unpack_from('<II', buffer, 0)
 
 			if self.signature != KDB4_SIGNATURE:
 				raise Exception("Signature does not match")
 
 			# Extract version (2 * 2 bytes) -> (minor, major)
-			self.version = struct.unpack('<hh', f_in.read(4))
+			self.version = struct.unpack_from('<hh', buffer, 8)
 
 			# Extract header
-			self.header = Header(f_in)
+			self.header, offset = Header.frombuffer(buffer, 12)
+
+			self.load(streams.BufferReader(buffer, offset), lazy)
 
-			# Extract encrypted database
-			encrypted = f_in.read()
+			buffer.release()
+		finally:
+			try:
+				mapped.close()
+			except BufferError:
+				# Views are still referenced by a traceback,
+				# the map is released once they are collected
+				pass
 
+		return self.database
+
+	def load(self, stream, lazy=False):
+		"""
+		Decrypt and extract the database following the header
+
+		@param stream stream Encrypted data
+		@param bool lazy Only decrypt protected values when they are accessed
+		@return Database
+		"""
 		# Generate master key
 		self.master_key = self.generate_master_key()
 
-		# Decrypt database
-		decrypted = self.decrypt(encrypted)
-
-		# Extract database
-		self.database = Database(io.BytesIO(decrypted), self.header.get('protected_stream_key'))
+		self.database = Database(
+			self.decrypt_stream(stream),
+			self.header.get('protected_stream_key'),
+			self.is_compressed(),
+			lazy,
+			self.concurrent
+		)
 
 		return self.database
 
@@ -76,37 +220,58 @@ class File:
 			# Get hash
 			hash = base64.b64encode(crypto.sha256(signature + version + header))
 
-			# Get database
-			database = self.database.serialize(hash)
+			# Encrypt stream start bytes and database while writing
+			writer = streams.CbcWriter(out, self.master_key, self.header.get('encryption_iv'))
+			writer.write(self.header.get('stream_start_bytes', True))
 
-			# Add stream start bytes
-			payload = self.header.get('stream_start_bytes', True) + database
+			self.database.serialize(hash, writer)
 
-			# Encrypt
-			encrypted = self.encrypt(payload)
+	def is_compressed(self):
+		"""
+		Check whether the payload is gzip compressed
 
-			out.write(encrypted)
+		@return bool
+		"""
+		compression = self.header.get('compression_flags')
 
-	def encrypt(self, stream):
-		data = crypto.pad(stream)
+		if compression not in (COMPRESSION_NONE, COMPRESSION_GZIP):
+			raise Exception("Unsupported compression")
 
-		return crypto.aes_cbc_encrypt(data, self.master_key, self.header.get('encryption_iv'))
+		return compression == COMPRESSION_GZIP
 
 	def generate_master_key(self):
 		# Generate composite key
 		composite_key = crypto.sha256(crypto.sha256(self.passphrase.encode('utf-8')))
 
-		# Init cipher
-		cipher = AES.new(self.header.get('transform_seed'), AES.MODE_ECB)
-
-		# Init transformed key
-		transformed_key = composite_key
+		# Look up transformed key
+		cache_key = None
+		transformed_key = None
+
+		if self.key_cache is not None:
+			cache_key = self.key_cache.make_key(
+				self.path,
+				self.header.get('transform_seed'),
+				self.header.get('transform_rounds'),
+				composite_key
+			)
+			transformed_key = self.key_cache.get(cache_key)
+
+		if transformed_key is not None:
+			self.transform_backend = 'cache'
+		else:
+			# Transform key
+			transformed_key, self.transform_backend = transform.transform_key(
+				composite_key,
+				self.header.get('transform_seed'),
+				self.header.get('transform_rounds'),
+				cancel=self.cancel
+			)
 
-		for x in range(0, self.header.get('transform_rounds')):
-			transformed_key = cipher.encrypt(transformed_key)
+			# Hash transformed key
+			transformed_key = crypto.sha256(transformed_key)
 
-		# Hash transformed key
-		transformed_key = crypto.sha256(transformed_key)
+			if cache_key is not None:
+				self.key_cache.put(cache_key, transformed_key)
 
 		# Concat master seed to transformed key
 		transformed_key = self.header.get('master_seed') + transformed_key
@@ -116,15 +281,23 @@ class File:
 
 		return self.master_key
 
-	def decrypt(self, encrypted):
-		cipher = AES.new(self.master_key, AES.MODE_CBC, self.header.get('encryption_iv'))
-		decrypted = crypto.unpad(cipher.decrypt(encrypted))
+	def decrypt_stream(self, stream):
+		"""
+		Get a decrypting reader for the encrypted part of the file
+		The stream start bytes are checked and skipped
+
+		@param stream stream
+		@return CbcReader
+		"""
+		reader = streams.CbcReader(stream, self.master_key, self.header.get('encryption_iv'))
+
+		start_bytes = self.header.get('stream_start_bytes')
 
 		# Check decryption
-		if decrypted[:len(self.header.get('stream_start_bytes'))] == self.header.get('stream_start_bytes'):
-			return decrypted[len(self.header.get('stream_start_bytes')):]
-		else:
+		if reader.read(len(start_bytes)) != start_bytes:
 			raise Exception("Decryption failed")
 
+		return reader
+
 	def stream_unpack(self, bytes, length, type):
 		return struct.unpack('<' + type, bytes.read(length))[0]
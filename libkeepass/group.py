@@ -2,21 +2,28 @@ import base64
 import uuid
 import datetime
 
+from lxml import etree
+
 from . import util
 from .entry import Entry
+from .lock import NULL_LOCK, reading, writing
+
+XPATH_ENTRIES = etree.XPath('./Entry')
+XPATH_GROUPS = etree.XPath('./Group')
 
 class Group:
-	def __init__(self, xml):
+	def __init__(self, xml, database=None):
 		self.xml = xml
+		self.database = database
 
 	@classmethod
-	def fromxml(cls, xml):
+	def fromxml(cls, xml, database=None):
 		"""
 		Parse group from xml
 		Wrapper for the constructor, acts as syntactic sugar
 		to describe the purpose of this constructing method better
 		"""
-		return cls(xml)
+		return cls(xml, database)
 
 	@classmethod
 	def create(cls, name):
@@ -53,8 +60,12 @@ class Group:
 
 		return cls(xml)
 
+	@property
+	def lock(self):
+		return self.database.lock if self.database is not None else NULL_LOCK
+
 	def get_id(self):
-		return self.xml.xpath('./UUID')[0].text
+		return self.xml.findtext('UUID')
 
 	def get_xml(self):
 		return self.xml
@@ -62,19 +73,129 @@ class Group:
 	def get_title(self):
 		return self.xml.find("Name").text
 
+	@reading
+	def get_path(self):
+		"""
+		Get names of the group and all enclosing groups, starting at the root
+
+		@return tuple[string]
+		"""
+		path = []
+		xml = self.xml
+
+		while xml is not None and xml.tag == 'Group':
+			path.append(xml.findtext('Name'))
+			xml = xml.getparent()
+
+		return tuple(reversed(path))
+
+	@reading
+	def get_parent(self):
+		"""
+		Get enclosing group, None for the root group
+
+		@return Group
+		"""
+		parent = self.xml.getparent()
+
+		if parent is None or parent.tag != 'Group':
+			return None
+
+		return Group(parent, self.database)
+
+	@reading
 	def get_entries(self):
 		entries = []
 
-		for entry_xml in self.xml.xpath('./Entry'):
-			entries.append(Entry.fromxml(entry_xml))
+		for entry_xml in XPATH_ENTRIES(self.xml):
+			entries.append(Entry.fromxml(entry_xml, self.database))
 
 		return entries
 
+	def iter_entries(self, recursive=True):
+		"""
+		Iterate entries of the group, including those of all subgroups
+		if `recursive` is set. History entries are skipped
+
+		@param bool recursive
+		@return generator[Entry]
+		"""
+		if not recursive:
+			yield from self.get_entries()
+			return
+
+		for entry_xml in self.xml.iter('Entry'):
+			if entry_xml.getparent().tag == 'Group':
+				yield Entry.fromxml(entry_xml, self.database)
+
+	@reading
+	def get_subgroups(self):
+		"""
+		Get direct subgroups
+
+		@return list[Group]
+		"""
+		return [Group(group_xml, self.database) for group_xml in XPATH_GROUPS(self.xml)]
+
 	def get_subgroup(self):
-		return Group(self.xml.xpath('./Group'))
+		return self.get_subgroups()
 
+	@writing
 	def add_entry(self, title, username=None, password=None, url=None):
 		entry = Entry.create(title, username, password, url)
+		entry.database = self.database
 		self.xml.append(entry.get_xml())
 
+		if self.database is not None:
+			self.database.index_add(entry.get_xml())
+
 		return entry.get_id()
+
+	@writing
+	def add_entries(self, entries):
+		"""
+		Add many entries at once
+		All entries share one timestamp and the indexes are updated after
+		all of them have been added. Besides title, username, password,
+		url, notes and tags, keys of the dicts become custom string fields
+
+		@param iterable[dict] entries
+		@return list[string] IDs of the new entries
+		"""
+		now = datetime.datetime.utcnow().isoformat()
+		created = []
+
+		for item in entries:
+			fields = dict(item)
+
+			entry = Entry.create(
+				fields.pop('title', None),
+				fields.pop('username', None),
+				fields.pop('password', None),
+				fields.pop('url', None),
+				fields.pop('notes', None),
+				fields.pop('tags', None),
+				fields,
+				now
+			)
+
+			entry.database = self.database
+			self.xml.append(entry.get_xml())
+			created.append(entry)
+
+		if self.database is not None:
+			self.database.index_add_many(entry.get_xml() for entry in created)
+
+		return [entry.get_id() for entry in created]
+
+	@writing
+	def remove_entry(self, entry):
+		"""
+		Remove entry from group
+
+		@param Entry entry
+		"""
+		self.xml.remove(entry.get_xml())
+
+		if self.database is not None:
+			self.database.index_remove(entry.get_xml())
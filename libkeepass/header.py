@@ -1,5 +1,8 @@
 import struct
 
+COMPRESSION_NONE = 0
+COMPRESSION_GZIP = 1
+
 class Header:
 	fields = {
 		'end_of_header': 0,
@@ -33,8 +36,27 @@ class Header:
 	data = {}
 	data_raw = {}
 
-	def __init__(self, stream):
-		self.deserialize(stream)
+	def __init__(self, stream=None):
+		# Every header needs its own fields
+		self.data = {}
+		self.data_raw = {}
+
+		if stream is not None:
+			self.deserialize(stream)
+
+	@classmethod
+	def frombuffer(cls, buffer, offset=0):
+		"""
+		Parse header from a buffer
+
+		@param buffer buffer
+		@param int offset Start of the header
+		@return (Header, int) Header and offset of the first byte after it
+		"""
+		header = cls()
+		offset = header.deserialize_buffer(buffer, offset)
+
+		return header, offset
 
 	def deserialize(self, stream):
 		while True:
@@ -53,6 +75,33 @@ class Header:
 			if field_id == 0:
 				break
 
+	def deserialize_buffer(self, buffer, offset=0):
+		"""
+		Parse header fields directly from a buffer
+
+		@param buffer buffer
+		@param int offset Start of the header
+		@return int Offset of the first byte after the header
+		"""
+		while True:
+			# Get ID and length
+			field_id, field_length = struct.unpack_from('<bh', buffer, offset)
+			offset += 3
+
+			# Get data
+			field_data = bytes(buffer[offset:offset + field_length])
+
+			if len(field_data) < field_length:
+				raise Exception("Unexpected end of header")
+
+			offset += field_length
+
+			self.set(field_id, field_data)
+
+			# End of header
+			if field_id == 0:
+				return offset
+
 	def serialize(self):
 		# Serialize header to stream
 		header = bytearray()
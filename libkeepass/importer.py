@@ -0,0 +1,140 @@
+import csv
+import json
+
+# Column names -> entry keys
+COLUMNS = {
+	'title': 'title',
+	'account': 'title',
+	'username': 'username',
+	'user name': 'username',
+	'login': 'username',
+	'login name': 'username',
+	'password': 'password',
+	'url': 'url',
+	'web site': 'url',
+	'website': 'url',
+	'notes': 'notes',
+	'comments': 'notes',
+	'tags': 'tags',
+	'group': 'group',
+}
+
+def import_csv(database, file, group=None, batch_size=1000):
+	"""
+	Import entries from CSV with a header row
+	Rows are read one by one and added in batches. Unknown columns become
+	custom string fields, an optional 'group' column holds a '/'-separated
+	path below `group`, missing groups are created.
+
+	@param Database database
+	@param file file Text stream
+	@param Group group Defaults to the root group
+	@param int batch_size
+	@return list[string] IDs of the new entries
+	"""
+	rows = (normalize(row) for row in csv.DictReader(file))
+
+	return import_rows(database, rows, group, batch_size)
+
+def import_json(database, file, group=None, batch_size=1000):
+	"""
+	Import entries from JSON Lines, one object per line
+	See import_csv for the handling of keys and groups
+
+	@param Database database
+	@param file file Text stream
+	@param Group group Defaults to the root group
+	@param int batch_size
+	@return list[string] IDs of the new entries
+	"""
+	rows = (normalize(json.loads(line)) for line in file if line.strip())
+
+	return import_rows(database, rows, group, batch_size)
+
+def normalize(row):
+	"""
+	Map column names to entry keys
+	Empty values are dropped
+
+	@param dict row
+	@return dict
+	"""
+	entry = {}
+
+	for key, value in row.items():
+		if key is None or value is None or value == "":
+			continue
+
+		entry[COLUMNS.get(key.strip().lower(), key)] = value
+
+	return entry
+
+def import_rows(database, rows, group=None, batch_size=1000):
+	"""
+	Add entries in batches through Group.add_entries
+
+	@param Database database
+	@param iterable[dict] rows
+	@param Group group Defaults to the root group
+	@param int batch_size
+	@return list[string] IDs of the new entries
+	"""
+	base = group if group is not None else database.get_root_group()
+
+	ids = []
+	batches = {}
+	count = 0
+
+	for row in rows:
+		path = row.pop('group', None) or ""
+		batches.setdefault(path, []).append(row)
+		count += 1
+
+		if count >= batch_size:
+			ids.extend(flush(database, base, batches))
+			batches = {}
+			count = 0
+
+	ids.extend(flush(database, base, batches))
+
+	return ids
+
+def flush(database, base, batches):
+	"""
+	Add batched entries to their groups
+
+	@param Database database
+	@param Group base
+	@param dict batches {path: [row]}
+	@return list[string] IDs of the new entries
+	"""
+	ids = []
+
+	for path, rows in batches.items():
+		ids.extend(resolve_group(database, base, path).add_entries(rows))
+
+	return ids
+
+def resolve_group(database, base, path):
+	"""
+	Find group by a '/'-separated path below `base`, creating missing groups
+
+	@param Database database
+	@param Group base
+	@param string path
+	@return Group
+	"""
+	group = base
+
+	for name in path.strip('/').split('/'):
+		if not name:
+			continue
+
+		subgroup = next((sub for sub in group.get_subgroups() if sub.get_title() == name), None)
+
+		if subgroup is None:
+			subgroup = database.get_group(database.add_group(name, group))
+
+		group = subgroup
+
+	return group
@@ -0,0 +1,132 @@
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+def normalize_title(title):
+	"""
+	Normalize title for lookups
+
+	@param string title
+	@return string
+	"""
+	return title.strip().casefold() if title else ""
+
+def normalize_host(url):
+	"""
+	Extract the lower-case host name of a URL
+	URLs without a scheme are treated as starting with the host
+
+	@param string url
+	@return string
+	"""
+	if not url:
+		return ""
+
+	url = url.strip()
+
+	if "//" not in url:
+		url = "//" + url
+
+	try:
+		return urlsplit(url).hostname or ""
+	except ValueError:
+		return ""
+
+class Index:
+	"""
+	Lookup tables for entries and groups
+	Entries are indexed by UUID, normalized title and URL host,
+	groups by UUID. History entries are not indexed.
+	"""
+	def __init__(self):
+		self.entries = {}
+		self.groups = {}
+		self.titles = defaultdict(set)
+		self.hosts = defaultdict(set)
+
+		# Indexed title and host of every entry
+		self._keys = {}
+
+	def add_entry(self, id, xml, title, url):
+		"""
+		Add entry
+
+		@param string id
+		@param Element xml
+		@param string title
+		@param string url
+		"""
+		self.remove_entry(id)
+
+		title = normalize_title(title)
+		host = normalize_host(url)
+
+		self.entries[id] = xml
+		self.titles[title].add(id)
+		self.hosts[host].add(id)
+		self._keys[id] = (title, host)
+
+	def remove_entry(self, id):
+		"""
+		Remove entry
+
+		@param string id
+		"""
+		if id not in self.entries:
+			return
+
+		del self.entries[id]
+		title, host = self._keys.pop(id)
+
+		self._discard(self.titles, title, id)
+		self._discard(self.hosts, host, id)
+
+	def add_group(self, id, xml):
+		"""
+		Add group
+
+		@param string id
+		@param Element xml
+		"""
+		self.groups[id] = xml
+
+	def remove_group(self, id):
+		"""
+		Remove group
+
+		@param string id
+		"""
+		self.groups.pop(id, None)
+
+	def find_by_title(self, title):
+		"""
+		Get IDs of entries with the given title
+
+		@param string title
+		@return set[string]
+		"""
+		return self.titles.get(normalize_title(title), set())
+
+	def find_by_host(self, host):
+		"""
+		Get IDs of entries whose URL has the given host
+
+		@param string host
+		@return set[string]
+		"""
+		return self.hosts.get(normalize_host(host), set())
+
+	def _discard(self, table, key, id):
+		"""
+		Remove ID from a table, dropping empty keys
+
+		@param dict table
+		@param string key
+		@param string id
+		"""
+		ids = table.get(key)
+
+		if ids is not None:
+			ids.discard(id)
+
+			if not ids:
+				del table[key]
@@ -1,45 +1,99 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 from .file import File
+from .vault import Vault
+from . import exporter
 
+# Default session, see Vault and VaultPool for handling several databases
+vault = None
 file = None
 database = None
 
 def open(path, passphrase):
+	global vault
 	global file
 	global database
-	file = File(path, passphrase)
-	database = file.open()
+	vault = Vault(path, passphrase)
+	file = vault.file
+	database = vault.database
+
+def open_many(specs, workers=None, snapshot=False, lazy=False):
+	"""
+	Open several databases at once
+	Key derivation and decryption run in a process pool. Parsing happens
+	in the calling process, as element trees can't be passed between
+	processes, unless snapshots are requested.
+
+	@param iterable[(string, string)] specs Path and passphrase of every file
+	@param int workers Number of processes, defaults to the number of CPUs
+	@param bool snapshot Return immutable snapshots parsed by the workers
+	@param bool lazy Only decrypt protected values when they are accessed
+	@return (dict, dict) {path: File or Snapshot}, {path: Exception}
+	"""
+	specs = list(specs)
+	paths = [os.path.realpath(path) for path, passphrase in specs]
+
+	if len(set(paths)) != len(paths):
+		raise Exception("Files must not be opened more than once")
+
+	results = {}
+	errors = {}
+
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		futures = [(path, passphrase, executor.submit(_unlock, path, passphrase, snapshot)) for path, passphrase in specs]
+
+		for path, passphrase, future in futures:
+			try:
+				result = future.result()
+
+				if snapshot:
+					results[path] = result
+				else:
+					# Keep the file, it holds header and master key for saving
+					f = File(path, passphrase)
+					f.signature, f.version, f.header, f.master_key, xml = result
+					f.load_xml(xml, lazy)
+					results[path] = f
+			except Exception as e:
+				errors[path] = e
+
+	return results, errors
+
+def _unlock(path, passphrase, snapshot=False):
+	# Runs in a worker process
+	f = File(path, passphrase)
+	xml = f.decrypt_payload()
+
+	if snapshot:
+		return f.load_xml(xml).snapshot()
+
+	return f.signature, f.version, f.header, f.master_key, xml
 
 def get_database():
-	return database.get(True)
+	return vault.get_database().get(True)
 
 def get_all_groups():
-	return database.get_groups()
+	return vault.get_all_groups()
 
 def add_group(name):
-	return database.add_group(name)
+	return vault.add_group(name)
 
-def add_attachment(entry, path):
-	if not os.path.isfile(path):
-		raise Exception("File does not exist")
+def add_attachment(entry, path, compress=False):
+	vault.add_attachment(entry, path, compress)
 
-	with open(path, 'rb') as file:
-		filename = os.path.basename(path)
-		content = file.read()
-
-		# Add attachment to database
-		ref_id = database.add_attachment(content)
-
-		# Add attachment to entry node
-		entry.add_attachment(filename, ref_id)
+def save_attachment(attachment, path):
+	vault.save_attachment(attachment, path)
 
 def remove_attachment(entry, attachment):
-	# Remove attachment from database
-	database.remove_attachment(attachment)
+	vault.remove_attachment(entry, attachment)
+
+def export(out, format='json', include_passwords=False):
+	return vault.export(out, format, include_passwords)
 
-	# Remove attachment from entry node
-	entry.remove_attachment(attachment)
+def export_file(path, passphrase, out, format='json', include_passwords=False):
+	# Streams entries out of the file without opening the database
+	return exporter.export(File(path, passphrase).iter_entries(), out, format, include_passwords)
 
 def save(path=None):
-	file.save(path)
+	vault.save(path)
@@ -0,0 +1,102 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from . import crypto
+
+class KeyCache:
+	"""
+	In-process cache of transformed keys
+	Entries are keyed on the file identity, the transform parameters and a
+	digest of the composite key, so the composite key itself is never stored.
+	"""
+	def __init__(self, ttl=300, max_size=64):
+		"""
+		Constructor
+
+		@param int ttl Seconds an entry stays valid, None for no expiry
+		@param int max_size Maximum number of cached keys
+		"""
+		self.ttl = ttl
+		self.max_size = max_size
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	@staticmethod
+	def make_key(path, transform_seed, transform_rounds, composite_key):
+		"""
+		Build cache key
+
+		@param string path
+		@param bytes transform_seed
+		@param int transform_rounds
+		@param bytes composite_key
+		@return tuple
+		"""
+		return (
+			os.path.realpath(path),
+			transform_seed,
+			transform_rounds,
+			crypto.sha256(composite_key)
+		)
+
+	def get(self, key):
+		"""
+		Get transformed key, None if missing or expired
+
+		@param tuple key
+		@return bytes
+		"""
+		with self._lock:
+			item = self._entries.get(key)
+
+			if item is None:
+				return None
+
+			transformed_key, expires = item
+
+			if expires is not None and expires < time.monotonic():
+				del self._entries[key]
+				return None
+
+			self._entries.move_to_end(key)
+
+			return transformed_key
+
+	def put(self, key, transformed_key):
+		"""
+		Store transformed key, evicting the least recently used
+		entries if the cache is full
+
+		@param tuple key
+		@param bytes transformed_key
+		"""
+		expires = time.monotonic() + self.ttl if self.ttl is not None else None
+
+		with self._lock:
+			self._entries[key] = (transformed_key, expires)
+			self._entries.move_to_end(key)
+
+			while len(self._entries) > self.max_size:
+				self._entries.popitem(last=False)
+
+	def purge(self, path=None):
+		"""
+		Remove cached keys
+		Removes all keys, or only those of the given file
+
+		@param string path
+		"""
+		with self._lock:
+			if path is None:
+				self._entries.clear()
+				return
+
+			path = os.path.realpath(path)
+
+			for key in [key for key in self._entries if key[0] == path]:
+				del self._entries[key]
+
+	def __len__(self):
+		return len(self._entries)
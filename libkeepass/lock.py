@@ -0,0 +1,152 @@
+import threading
+import functools
+from collections import deque
+from contextlib import contextmanager
+
+class RWLock:
+	"""
+	Readers-writer lock
+	Any number of readers or a single writer hold the lock at a time.
+	Waiting writers go first, so a steady stream of readers can't starve
+	them, and get the lock in the order they asked for it. Both modes are
+	reentrant and the writer may also read, but a reader can't upgrade to
+	writing.
+	"""
+	def __init__(self):
+		self._cond = threading.Condition(threading.Lock())
+		self._readers = 0
+		self._writer = None
+		self._writes = 0
+
+		# Threads waiting for the write lock, in order of arrival
+		self._writers_waiting = deque()
+		self._local = threading.local()
+
+	@contextmanager
+	def read(self):
+		self.acquire_read()
+
+		try:
+			yield
+		finally:
+			self.release_read()
+
+	@contextmanager
+	def write(self):
+		self.acquire_write()
+
+		try:
+			yield
+		finally:
+			self.release_write()
+
+	def acquire_read(self):
+		me = threading.get_ident()
+		count = getattr(self._local, 'reads', 0)
+
+		with self._cond:
+			# Nested reads must not wait for writers, they'd wait for themselves
+			if count == 0 and self._writer != me:
+				while self._writer is not None or self._writers_waiting:
+					self._cond.wait()
+
+			self._readers += 1
+
+		self._local.reads = count + 1
+
+	def release_read(self):
+		self._local.reads -= 1
+
+		with self._cond:
+			self._readers -= 1
+
+			if self._readers == 0:
+				self._cond.notify_all()
+
+	def acquire_write(self):
+		me = threading.get_ident()
+
+		with self._cond:
+			if self._writer == me:
+				self._writes += 1
+				return
+
+			if getattr(self._local, 'reads', 0):
+				raise Exception("Can't upgrade read lock to write lock")
+
+			self._writers_waiting.append(me)
+
+			try:
+				while self._writer is not None or self._readers or self._writers_waiting[0] != me:
+					self._cond.wait()
+			finally:
+				self._writers_waiting.remove(me)
+
+				# Let the next writer check its turn
+				self._cond.notify_all()
+
+			self._writer = me
+			self._writes = 1
+
+	def release_write(self):
+		with self._cond:
+			self._writes -= 1
+
+			if self._writes == 0:
+				self._writer = None
+				self._cond.notify_all()
+
+class NullLock:
+	"""
+	Lock doing nothing, used when a database isn't shared between threads
+	"""
+	@contextmanager
+	def read(self):
+		yield
+
+	@contextmanager
+	def write(self):
+		yield
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+NULL_LOCK = NullLock()
+
+def reading(method):
+	"""
+	Run method holding the read lock of `self.lock`
+	"""
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		with self.lock.read():
+			return method(self, *args, **kwargs)
+
+	return wrapper
+
+def writing(method):
+	"""
+	Run method holding the write lock of `self.lock`
+	"""
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		with self.lock.write():
+			return method(self, *args, **kwargs)
+
+	return wrapper
+
+def modifying(method):
+	"""
+	Run method holding the write lock of `self.lock` and count it in
+	`self.changes`
+	"""
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		with self.lock.write():
+			self.changes += 1
+			return method(self, *args, **kwargs)
+
+	return wrapper
@@ -0,0 +1,120 @@
+import base64
+from lxml import etree
+
+from . import crypto
+from . import streams
+from .record import EntryRecord
+
+class ReadOnlyDatabase:
+	"""
+	Read-only database streaming entries out of the decrypted payload
+	No element tree is kept: every entry is turned into an EntryRecord as
+	soon as it is parsed and then removed from the tree, so memory stays
+	flat regardless of the size of the database. Entries can only be
+	iterated once.
+	"""
+	def __init__(self, stream, protected_stream_key, compressed=False):
+		"""
+		Constructor
+
+		@param stream stream Hashed block stream
+		@param bytes protected_stream_key
+		@param bool compressed Whether the payload is gzip compressed
+		"""
+		self.stream = stream
+		self.protected_stream_key = protected_stream_key
+		self.compressed = compressed
+
+	def iter_entries(self):
+		"""
+		Yield all entries in document order
+		History entries are skipped, protected values are decrypted
+
+		@return generator[EntryRecord]
+		"""
+		chunks = streams.iter_hashed_blocks(self.stream)
+
+		if self.compressed:
+			chunks = streams.iter_gunzip(chunks)
+
+		# Protected values are decrypted in document order
+		cipher = crypto.salsa20(self.protected_stream_key)
+
+		group_path = []
+		history = 0
+
+		# Shared by all records of a group
+		path = ()
+
+		events = etree.iterparse(streams.IterReader(chunks), events=('start', 'end'), remove_blank_text=True)
+
+		for event, elem in events:
+			tag = elem.tag
+
+			if event == 'start':
+				if tag == 'Group':
+					group_path.append(None)
+					path = tuple(group_path)
+				elif tag == 'History':
+					history += 1
+
+				continue
+
+			if tag == 'Value' and elem.get('Protected') == 'True' and elem.text is not None:
+				decoded = base64.b64decode(elem.text.encode("utf-8"))
+				elem.text = cipher.decrypt(decoded).decode("utf-8")
+			elif tag == 'Name' and elem.getparent().tag == 'Group':
+				group_path[-1] = elem.text or ''
+				path = tuple(group_path)
+			elif tag == 'History':
+				history -= 1
+			elif tag == 'Entry' and not history:
+				yield self._record(elem, path)
+				self._release(elem)
+			elif tag == 'Group':
+				group_path.pop()
+				path = tuple(group_path)
+				self._release(elem)
+			elif tag == 'Binary' and elem.getparent().tag == 'Binaries':
+				# Attachment contents are never needed
+				self._release(elem)
+			elif tag == 'Meta':
+				self._release(elem)
+
+	def _record(self, elem, group_path):
+		"""
+		Build record from an entry element
+
+		@param Element elem
+		@param tuple[string] group_path
+		@return EntryRecord
+		"""
+		fields = {}
+		attachments = []
+		protected = []
+
+		for child in elem:
+			if child.tag == 'String':
+				key = child.findtext('Key')
+				fields[key] = child.findtext('Value')
+
+				if child.find('Value').get('Protected') is not None:
+					protected.append(key)
+			elif child.tag == 'Binary':
+				attachments.append((child.findtext('Key'), child.find('Value').get('Ref')))
+
+		return EntryRecord(elem.findtext('UUID'), group_path, fields, elem.findtext('Tags'), tuple(attachments), protected)
+
+	def _release(self, elem):
+		"""
+		Drop a processed element and its preceding siblings
+
+		@param Element elem
+		"""
+		elem.clear()
+
+		parent = elem.getparent()
+
+		if parent is not None:
+			while elem.getprevious() is not None:
+				del parent[0]
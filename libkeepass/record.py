@@ -0,0 +1,192 @@
+import sys
+import types
+
+class Record:
+	"""
+	Immutable record with __slots__
+	"""
+	__slots__ = ()
+
+	def __setattr__(self, name, value):
+		raise AttributeError("{} is read-only".format(type(self).__name__))
+
+	def __delattr__(self, name):
+		raise AttributeError("{} is read-only".format(type(self).__name__))
+
+	def __reduce__(self):
+		return (type(self)._restore, tuple(getattr(self, slot) for slot in self.__slots__))
+
+	@classmethod
+	def _restore(cls, *values):
+		"""
+		Rebuild record from its slot values, used for pickling
+
+		@return Record
+		"""
+		record = object.__new__(cls)
+
+		for slot, value in zip(cls.__slots__, values):
+			object.__setattr__(record, slot, value)
+
+		return record
+
+class EntryRecord(Record):
+	"""
+	Lightweight read-only representation of an entry
+	Field keys are interned and stored next to the values in tuples
+	"""
+	__slots__ = ('id', 'group_path', 'keys', 'values', 'tags', 'attachments', 'protected')
+
+	def __init__(self, id, group_path, fields, tags=None, attachments=(), protected=()):
+		"""
+		Constructor
+
+		@param string id
+		@param tuple[string] group_path Names of all enclosing groups
+		@param dict fields {key: value} of all string fields
+		@param string tags
+		@param tuple[(string, string)] attachments Filename and binary ID
+		@param tuple[string] protected Keys of protected fields
+		"""
+		object.__setattr__(self, 'id', id)
+		object.__setattr__(self, 'group_path', group_path)
+		object.__setattr__(self, 'keys', tuple(sys.intern(key) for key in fields))
+		object.__setattr__(self, 'values', tuple(fields.values()))
+		object.__setattr__(self, 'tags', tags)
+		object.__setattr__(self, 'attachments', attachments)
+		object.__setattr__(self, 'protected', tuple(sys.intern(key) for key in protected))
+
+	@property
+	def fields(self):
+		"""
+		Get all string fields
+
+		@return dict {key: value}
+		"""
+		return dict(zip(self.keys, self.values))
+
+	def get_field(self, key):
+		"""
+		Get value of a string field
+
+		@param string key
+		@return string
+		"""
+		try:
+			return self.values[self.keys.index(key)]
+		except ValueError:
+			return None
+
+	def get_id(self):
+		return self.id
+
+	def get_title(self):
+		return self.get_field("Title")
+
+	def get_username(self):
+		return self.get_field("UserName")
+
+	def get_password(self):
+		return self.get_field("Password")
+
+	def get_url(self):
+		return self.get_field("URL")
+
+	def get_notes(self):
+		return self.get_field("Notes")
+
+	def __repr__(self):
+		return "EntryRecord({!r}, {!r})".format(self.id, self.get_title())
+
+class GroupRecord(Record):
+	"""
+	Lightweight read-only representation of a group
+	"""
+	__slots__ = ('id', 'name', 'path', 'parent_id', 'entry_ids', 'group_ids')
+
+	def __init__(self, id, name, path, parent_id, entry_ids, group_ids):
+		"""
+		Constructor
+
+		@param string id
+		@param string name
+		@param tuple[string] path Names of the group and all enclosing groups
+		@param string parent_id None for the root group
+		@param tuple[string] entry_ids IDs of the direct entries
+		@param tuple[string] group_ids IDs of the direct subgroups
+		"""
+		object.__setattr__(self, 'id', id)
+		object.__setattr__(self, 'name', name)
+		object.__setattr__(self, 'path', path)
+		object.__setattr__(self, 'parent_id', parent_id)
+		object.__setattr__(self, 'entry_ids', entry_ids)
+		object.__setattr__(self, 'group_ids', group_ids)
+
+	def get_id(self):
+		return self.id
+
+	def get_title(self):
+		return self.name
+
+	def __repr__(self):
+		return "GroupRecord({!r}, {!r})".format(self.id, self.name)
+
+class Snapshot(Record):
+	"""
+	Immutable copy of all groups and entries of a database
+	Entries and groups are exposed as read-only mappings
+	"""
+	__slots__ = ('entries', 'groups')
+
+	def __init__(self, entries, groups):
+		"""
+		Constructor
+
+		@param dict entries {id: EntryRecord} in document order
+		@param dict groups {id: GroupRecord} in document order
+		"""
+		object.__setattr__(self, 'entries', types.MappingProxyType(dict(entries)))
+		object.__setattr__(self, 'groups', types.MappingProxyType(dict(groups)))
+
+	def __reduce__(self):
+		# Mapping proxies can't be pickled
+		return (type(self), (dict(self.entries), dict(self.groups)))
+
+	def get_entry(self, id):
+		"""
+		Get entry by UUID
+
+		@param string id
+		@return EntryRecord
+		"""
+		return self.entries.get(id)
+
+	def get_group(self, id):
+		"""
+		Get group by UUID
+
+		@param string id
+		@return GroupRecord
+		"""
+		return self.groups.get(id)
+
+	def get_entries(self, group_id=None):
+		"""
+		Get all entries, or the direct entries of a group
+
+		@param string group_id
+		@return list[EntryRecord]
+		"""
+		if group_id is None:
+			return list(self.entries.values())
+
+		return [self.entries[id] for id in self.groups[group_id].entry_ids]
+
+	def find_entries(self, predicate):
+		"""
+		Get all entries matching a predicate
+
+		@param callable predicate (EntryRecord) -> bool
+		@return list[EntryRecord]
+		"""
+		return [entry for entry in self.entries.values() if predicate(entry)]
@@ -0,0 +1,383 @@
+import re
+import math
+import heapq
+from collections import defaultdict
+
+# Ranking weight of a match per field, other fields weigh 1
+FIELD_WEIGHTS = {
+	'Title': 4,
+	'UserName': 2,
+	'URL': 2,
+	'Tags': 2,
+}
+
+# Share of a token's trigrams a fuzzy match must contain
+FUZZY_THRESHOLD = 0.5
+
+# Match quality of a word equal to, starting with or containing a token
+EXACT = 2
+PREFIX = 1.5
+SUBSTRING = 1
+
+WORD_SPLIT = re.compile(r'\W+')
+
+def trigrams(text):
+	"""
+	Get all trigrams of a text
+
+	@param string text
+	@return set[string]
+	"""
+	return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def prefix_trigrams(word):
+	"""
+	Get the trigrams marking the start of a word
+	Words are padded with two spaces, so tokens shorter than three
+	characters can be looked up as word prefixes
+
+	@param string word
+	@return set[string]
+	"""
+	return trigrams("  " + word[:2])
+
+class SearchIndex:
+	"""
+	Inverted index over the words in the string fields of entries
+	Tokens are matched against the vocabulary through a trigram index of
+	its words. As a token can't span words, an entry matches a token if
+	one of its words does, and scores by the best of them.
+	"""
+	def __init__(self):
+		# Word -> {field weight: IDs of entries having the word in such a field}
+		self.words = {}
+
+		# Field weight -> {trigram: words occurring in such a field}
+		self.grams = {}
+
+		# ID -> {word: highest weight of the fields containing it}
+		self.documents = {}
+
+	def add(self, id, fields):
+		"""
+		Add or replace an entry
+
+		@param string id
+		@param dict fields {field: text}
+		"""
+		self.remove(id)
+
+		document = {}
+
+		for key, text in fields.items():
+			if not text:
+				continue
+
+			weight = FIELD_WEIGHTS.get(key, 1)
+
+			for word in WORD_SPLIT.split(text.casefold()):
+				if word and document.get(word, 0) < weight:
+					document[word] = weight
+
+		for word, weight in document.items():
+			postings = self.words.setdefault(word, {})
+
+			if weight not in postings:
+				postings[weight] = set()
+				grams = self.grams.setdefault(weight, defaultdict(set))
+
+				for gram in trigrams(word) | prefix_trigrams(word):
+					grams[gram].add(word)
+
+			postings[weight].add(id)
+
+		self.documents[id] = document
+
+	def remove(self, id):
+		"""
+		Remove an entry
+
+		@param string id
+		"""
+		document = self.documents.pop(id, None)
+
+		if document is None:
+			return
+
+		for word, weight in document.items():
+			postings = self.words[word]
+			postings[weight].discard(id)
+
+			if postings[weight]:
+				continue
+
+			del postings[weight]
+
+			if not postings:
+				del self.words[word]
+
+			grams = self.grams[weight]
+
+			for gram in trigrams(word) | prefix_trigrams(word):
+				grams[gram].discard(word)
+
+				if not grams[gram]:
+					del grams[gram]
+
+	def search(self, query, limit=None, fuzzy=False):
+		"""
+		Find entries matching all words of the query
+		Words of three or more characters match anywhere in a field, shorter
+		ones match the start of a word. With `fuzzy`, words also match words
+		containing most of their trigrams. Entries scoring the same as the
+		last one within `limit` may be left out for each other.
+
+		@param string query
+		@param int limit Maximum number of results
+		@param bool fuzzy
+		@return list[(string, float)] IDs and scores, best match first
+		"""
+		tokens = [token for token in WORD_SPLIT.split(query.casefold()) if token]
+
+		if not tokens:
+			return []
+
+		if len(tokens) == 1:
+			scores = self._search_token(tokens[0], limit, fuzzy)
+		else:
+			scores = self._search_tokens(tokens, fuzzy)
+
+		key = lambda item: (-item[1], item[0])
+
+		if limit is not None:
+			return heapq.nsmallest(limit, scores.items(), key=key)
+
+		return sorted(scores.items(), key=key)
+
+	def _search_token(self, token, limit, fuzzy):
+		"""
+		Score entries for a single token
+		Matching words come best first, so an entry is scored by the first
+		word it's found through, and the search stops once `limit` entries
+		are found
+
+		@param string token
+		@param int limit
+		@param bool fuzzy
+		@return dict {id: score}
+		"""
+		scores = {}
+
+		for score, word, weight in self._ranked(token, fuzzy):
+			for id in self.words[word][weight]:
+				if id in scores:
+					continue
+
+				scores[id] = score
+
+				if len(scores) == limit:
+					return scores
+
+		return scores
+
+	def _search_tokens(self, tokens, fuzzy):
+		"""
+		Score entries matching all of several tokens
+		Candidates are the entries matching the most selective token, the
+		other tokens are scored against their words
+
+		@param list[string] tokens
+		@param bool fuzzy
+		@return dict {id: score}
+		"""
+		# Longer tokens tend to be rarer, counting them first lets the
+		# counts of common tokens stop early
+		tokens = sorted(tokens, key=len, reverse=True)
+		best = None
+
+		for i, token in enumerate(tokens):
+			count = self._selectivity(token, best)
+
+			if best is None or count < best:
+				first = i
+				best = count
+
+		tokens.insert(0, tokens.pop(first))
+		scores = {}
+
+		for score, word, weight in self._ranked(tokens[0], fuzzy):
+			for id in self.words[word][weight]:
+				if id not in scores:
+					scores[id] = score
+
+		for token in tokens[1:]:
+			token_scores = {}
+
+			for id, score in scores.items():
+				token_score = self._score(self.documents[id], token, fuzzy)
+
+				# Entries must match every token
+				if token_score:
+					token_scores[id] = score + token_score
+
+			scores = token_scores
+
+		return scores
+
+	def _ranked(self, token, fuzzy):
+		"""
+		Get the words matching a token with the weight of the fields they
+		occur in, best score first
+
+		@param string token
+		@param bool fuzzy
+		@return iterator[(float, string, int)] Scores, words and weights
+		"""
+		short = len(token) < 3
+		grams = prefix_trigrams(token) if short else trigrams(token)
+		qualities = (EXACT, PREFIX) if short else (EXACT, PREFIX, SUBSTRING)
+
+		# Words containing the token but not starting with it, per weight,
+		# set aside while going through the words starting with it
+		substrings = {}
+
+		levels = sorted(((quality * weight, quality, weight) for weight in self.grams for quality in qualities), reverse=True)
+		ranked = ((score, word, weight) for score, quality, weight in levels for word in self._words(token, grams, weight, quality, substrings))
+
+		if not fuzzy or short:
+			return ranked
+
+		return heapq.merge(ranked, self._fuzzy(token, grams), key=lambda match: -match[0])
+
+	def _words(self, token, grams, weight, quality, substrings):
+		"""
+		Get the words of fields with a given weight matching a token with a
+		given quality
+		Substring matches are collected while looking for prefix matches,
+		which always rank higher
+
+		@param string token
+		@param set grams Trigrams of the token
+		@param int weight
+		@param float quality
+		@param dict substrings {weight: words}
+		@return iterator[string]
+		"""
+		if quality == EXACT:
+			if weight in self.words.get(token, ()):
+				yield token
+
+			return
+
+		if quality == SUBSTRING:
+			yield from substrings.get(weight, ())
+			return
+
+		postings = sorted((self.grams[weight].get(gram, ()) for gram in grams), key=len)
+
+		if not postings[0]:
+			return
+
+		rest = substrings[weight] = []
+
+		# Going through the rarest trigram lazily, so a search that stops
+		# early doesn't pay for the full intersection
+		for word in postings[0]:
+			if any(word not in words for words in postings[1:]):
+				continue
+			elif word == token:
+				continue
+			elif word.startswith(token):
+				yield word
+			elif token in word:
+				rest.append(word)
+
+	def _fuzzy(self, token, grams):
+		"""
+		Get the words containing most but not all of a token
+		Words containing the whole token are left out
+
+		@param string token
+		@param set grams Trigrams of the token
+		@return list[(float, string, int)] Scores, words and weights, best first
+		"""
+		# A match must contain at least one of the rarest trigrams
+		needed = math.ceil(FUZZY_THRESHOLD * len(grams))
+		matches = []
+
+		for weight, index in self.grams.items():
+			postings = sorted((index.get(gram, set()) for gram in grams), key=len)
+
+			for word in set().union(*postings[:len(grams) - needed + 1]):
+				if token in word:
+					continue
+
+				ratio = sum(1 for words in postings if word in words) / len(grams)
+
+				if ratio >= FUZZY_THRESHOLD:
+					matches.append((ratio / 2, word, weight))
+
+		matches.sort(key=lambda match: -match[0])
+
+		return matches
+
+	def _score(self, document, token, fuzzy):
+		"""
+		Score a single entry for a token
+
+		@param dict document {word: weight}
+		@param string token
+		@param bool fuzzy
+		@return float
+		"""
+		short = len(token) < 3
+		best = 0
+
+		for word, weight in document.items():
+			if token not in word:
+				continue
+
+			if word == token:
+				quality = EXACT
+			elif word.startswith(token):
+				quality = PREFIX
+			elif short:
+				continue
+			else:
+				quality = SUBSTRING
+
+			best = max(best, quality * weight)
+
+		if best or not fuzzy or short:
+			return best
+
+		grams = trigrams(token)
+
+		for word in document:
+			ratio = len(grams & trigrams(word)) / len(grams)
+
+			if ratio >= FUZZY_THRESHOLD:
+				best = max(best, ratio / 2)
+
+		return best
+
+	def _selectivity(self, token, bound=None):
+		"""
+		Estimate how many entries a token matches, by the entries having a
+		word with its rarest trigram
+
+		@param string token
+		@param int bound Stop counting at this number
+		@return int
+		"""
+		grams = prefix_trigrams(token) if len(token) < 3 else trigrams(token)
+		count = 0
+
+		for weight, index in self.grams.items():
+			for word in min((index.get(gram, ()) for gram in grams), key=len):
+				count += len(self.words[word][weight])
+
+				if bound is not None and count >= bound:
+					return count
+
+		return count
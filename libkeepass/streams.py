@@ -0,0 +1,440 @@
+import struct
+import hashlib
+import zlib
+import base64
+from Crypto.Cipher import AES
+
+from . import crypto
+
+# Size of the data part of a hashed block
+BLOCK_SIZE = 1024 * 1024
+
+class BufferReader:
+	"""
+	Reader over a buffer returning memoryview slices instead of copies
+	"""
+	def __init__(self, buffer, offset=0):
+		"""
+		Constructor
+
+		@param buffer buffer
+		@param int offset
+		"""
+		self.buffer = memoryview(buffer)
+		self.offset = offset
+
+	def read(self, size=-1):
+		"""
+		Read from the buffer
+
+		@param int size Number of bytes, everything if negative
+		@return memoryview
+		"""
+		end = len(self.buffer) if size < 0 else min(self.offset + size, len(self.buffer))
+		data = self.buffer[self.offset:end]
+		self.offset = end
+
+		return data
+
+def iter_hashed_blocks(stream):
+	"""
+	Read hashed blocks from a stream and verify them
+	Yields the data of every block until the terminating empty block.
+
+	@param stream stream
+	@return generator[bytes]
+	"""
+	expected_index = 0
+
+	while True:
+		# Index (4 bytes), hash (32 bytes), length (4 bytes)
+		block_header = stream.read(40)
+
+		if len(block_header) < 40:
+			raise Exception("Unexpected end of hashed block stream")
+
+		index, hash, length = struct.unpack('<I32sI', block_header)
+
+		if index != expected_index:
+			raise Exception("Hashed block index does not match")
+
+		# End of stream
+		if length == 0:
+			if hash != b'\x00' * 32:
+				raise Exception("Invalid final hashed block")
+			break
+
+		# Data
+		data = stream.read(length)
+
+		if len(data) < length:
+			raise Exception("Unexpected end of hashed block stream")
+
+		if hashlib.sha256(data).digest() != hash:
+			raise Exception("Hashed block {} is corrupt".format(index))
+
+		yield data
+
+		expected_index += 1
+
+def iter_gunzip(chunks, max_length=BLOCK_SIZE):
+	"""
+	Decompress gzip data incrementally
+	No yielded chunk is larger than `max_length`
+
+	@param iterable[bytes] chunks
+	@param int max_length
+	@return generator[bytes]
+	"""
+	decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+	for chunk in chunks:
+		while chunk:
+			data = decompressor.decompress(chunk, max_length)
+			chunk = decompressor.unconsumed_tail
+
+			if data:
+				yield data
+
+	data = decompressor.flush()
+
+	if data:
+		yield data
+
+	if not decompressor.eof:
+		raise Exception("Unexpected end of compressed stream")
+
+def iter_gzip(chunks, level=6):
+	"""
+	Compress data with gzip incrementally
+
+	@param iterable[bytes] chunks
+	@param int level
+	@return generator[bytes]
+	"""
+	compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+	for chunk in chunks:
+		data = compressor.compress(chunk)
+
+		if data:
+			yield data
+
+	yield compressor.flush()
+
+def iter_b64encode(chunks):
+	"""
+	Base64-encode data incrementally
+
+	@param iterable[bytes] chunks
+	@return generator[string]
+	"""
+	remainder = b''
+
+	for chunk in chunks:
+		data = remainder + chunk
+
+		# Only encode complete groups of 3 bytes
+		length = len(data) - len(data) % 3
+		remainder = data[length:]
+
+		if length:
+			yield base64.b64encode(data[:length]).decode("utf-8")
+
+	if remainder:
+		yield base64.b64encode(remainder).decode("utf-8")
+
+def iter_b64decode(text, chunk_size=BLOCK_SIZE):
+	"""
+	Base64-decode a string in slices
+	Whitespace such as line breaks is skipped
+
+	@param string text
+	@param int chunk_size Approximate size of the decoded chunks
+	@return generator[bytes]
+	"""
+	step = chunk_size // 3 * 4
+	remainder = ""
+
+	for offset in range(0, len(text), step):
+		data = remainder + "".join(text[offset:offset + step].split())
+
+		# Only decode complete groups of 4 characters
+		length = len(data) - len(data) % 4
+		remainder = data[length:]
+
+		if length:
+			yield base64.b64decode(data[:length])
+
+	if remainder:
+		yield base64.b64decode(remainder)
+
+def iter_file(file, chunk_size=BLOCK_SIZE):
+	"""
+	Read a file in chunks
+
+	@param file file
+	@param int chunk_size
+	@return generator[bytes]
+	"""
+	while True:
+		data = file.read(chunk_size)
+
+		if not data:
+			break
+
+		yield data
+
+class IterReader:
+	"""
+	Readable stream over an iterable of chunks
+	"""
+	def __init__(self, chunks):
+		"""
+		Constructor
+
+		@param iterable[bytes] chunks
+		"""
+		self.chunks = iter(chunks)
+		self.buffer = bytearray()
+
+	def read(self, size=-1):
+		"""
+		Read data
+
+		@param int size Number of bytes, everything if negative
+		@return bytes
+		"""
+		while size < 0 or len(self.buffer) < size:
+			chunk = next(self.chunks, None)
+
+			if chunk is None:
+				break
+
+			self.buffer.extend(chunk)
+
+		if size < 0 or size >= len(self.buffer):
+			data = bytes(self.buffer)
+			self.buffer = bytearray()
+		else:
+			data = bytes(self.buffer[:size])
+			del self.buffer[:size]
+
+		return data
+
+	def close(self):
+		"""
+		Stop reading
+		"""
+		self.chunks = iter(())
+		self.buffer = bytearray()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+def finish(out):
+	"""
+	Finish the next stage of a writer pipeline
+
+	@param stream out
+	"""
+	if hasattr(out, 'finish'):
+		out.finish()
+
+class HashedBlockWriter:
+	"""
+	Writer splitting data into hashed blocks
+	"""
+	def __init__(self, out):
+		"""
+		Constructor
+
+		@param stream out
+		"""
+		self.out = out
+		self.index = 0
+		self.buffer = bytearray()
+
+	def write(self, data):
+		"""
+		Write data, full blocks are passed on immediately
+
+		@param bytes data
+		"""
+		self.buffer.extend(data)
+
+		while len(self.buffer) >= BLOCK_SIZE:
+			self._write_block(bytes(self.buffer[:BLOCK_SIZE]))
+			del self.buffer[:BLOCK_SIZE]
+
+	def finish(self):
+		"""
+		Write remaining data and the terminating empty block
+		"""
+		if self.buffer:
+			self._write_block(bytes(self.buffer))
+			self.buffer = bytearray()
+
+		self.out.write(struct.pack('<I32sI', self.index, b'\x00' * 32, 0))
+
+		finish(self.out)
+
+	def _write_block(self, data):
+		"""
+		Write a single block
+
+		@param bytes data
+		"""
+		self.out.write(struct.pack('<I32sI', self.index, hashlib.sha256(data).digest(), len(data)))
+		self.out.write(data)
+		self.index += 1
+
+class GzipWriter:
+	"""
+	Writer compressing data with gzip
+	"""
+	def __init__(self, out, level=6):
+		"""
+		Constructor
+
+		@param stream out
+		@param int level
+		"""
+		self.out = out
+		self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+	def write(self, data):
+		"""
+		Compress and write data
+
+		@param bytes data
+		"""
+		compressed = self.compressor.compress(data)
+
+		if compressed:
+			self.out.write(compressed)
+
+	def finish(self):
+		"""
+		Flush the compressor
+		"""
+		self.out.write(self.compressor.flush())
+
+		finish(self.out)
+
+class CbcWriter:
+	"""
+	Writer encrypting data with AES in CBC mode
+	Data is encrypted as soon as full AES blocks are available,
+	PKCS5 padding is added when finishing
+	"""
+	def __init__(self, out, key, iv):
+		"""
+		Constructor
+
+		@param stream out
+		@param bytes key
+		@param bytes iv
+		"""
+		self.out = out
+		self.cipher = AES.new(key, AES.MODE_CBC, iv)
+		self.buffer = bytearray()
+
+	def write(self, data):
+		"""
+		Encrypt and write data
+
+		@param bytes data
+		"""
+		self.buffer.extend(data)
+
+		length = len(self.buffer) - len(self.buffer) % crypto.AES_BLOCK_SIZE
+
+		if length:
+			self.out.write(self.cipher.encrypt(bytes(self.buffer[:length])))
+			del self.buffer[:length]
+
+	def finish(self):
+		"""
+		Pad and encrypt the remaining data
+		"""
+		self.out.write(self.cipher.encrypt(crypto.pad(bytes(self.buffer))))
+		self.buffer = bytearray()
+
+		finish(self.out)
+
+class CbcReader:
+	"""
+	Reader decrypting an AES-CBC encrypted stream chunk by chunk
+	The last decrypted block is held back until the end of the stream
+	is reached, so the PKCS5 padding can be removed.
+	"""
+	chunk_size = 64 * 1024
+
+	def __init__(self, stream, key, iv):
+		"""
+		Constructor
+
+		@param stream stream Encrypted stream
+		@param bytes key
+		@param bytes iv
+		"""
+		self.stream = stream
+		self.cipher = AES.new(key, AES.MODE_CBC, iv)
+		self.buffer = bytearray()
+		self.held = b''
+		self.remainder = b''
+		self.eof = False
+
+	def read(self, size=-1):
+		"""
+		Read decrypted data
+
+		@param int size Number of bytes, everything if negative
+		@return bytes
+		"""
+		while not self.eof and (size < 0 or len(self.buffer) < size):
+			self._fill()
+
+		if size < 0 or size >= len(self.buffer):
+			data = bytes(self.buffer)
+			self.buffer = bytearray()
+		else:
+			data = bytes(self.buffer[:size])
+			del self.buffer[:size]
+
+		return data
+
+	def _fill(self):
+		"""
+		Decrypt the next chunk of the stream
+		"""
+		data = self.stream.read(self.chunk_size)
+
+		if not data:
+			if self.remainder:
+				raise Exception("Encrypted data is not a multiple of the block size")
+
+			self.buffer.extend(crypto.unpad(self.held))
+			self.held = b''
+			self.eof = True
+			return
+
+		if self.remainder:
+			data = self.remainder + bytes(data)
+
+		# Only decrypt complete blocks
+		length = len(data) - len(data) % crypto.AES_BLOCK_SIZE
+		self.remainder = bytes(data[length:])
+
+		if length == 0:
+			return
+
+		decrypted = self.cipher.decrypt(data[:length])
+
+		self.buffer.extend(self.held)
+		self.buffer.extend(decrypted[:-crypto.AES_BLOCK_SIZE])
+		self.held = decrypted[-crypto.AES_BLOCK_SIZE:]
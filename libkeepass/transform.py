@@ -0,0 +1,129 @@
+from collections import OrderedDict
+from Crypto.Cipher import AES
+
+from . import crypto
+
+# Number of AES rounds handed to the cipher per call in the bulk backend
+CHUNK_ROUNDS = 64 * 1024
+
+# Number of rounds between checks for cancellation
+CANCEL_ROUNDS = 16 * CHUNK_ROUNDS
+
+class Cancelled(Exception):
+	"""
+	Raised when a key transformation is cancelled
+	"""
+
+backends = OrderedDict()
+
+def register_backend(name, func):
+	"""
+	Register a key transform backend
+	Backends are tried in registration order, the first one that
+	succeeds is used
+
+	@param string name
+	@param callable func (half, seed, rounds) -> bytes
+	"""
+	backends[name] = func
+
+def transform_cbc(half, seed, rounds):
+	"""
+	Encrypt a 16 byte block `rounds` times in bulk
+	CBC-encrypting zero blocks with the block as IV chains every
+	ciphertext into the next block, so the last block of the output
+	equals `rounds` ECB encryptions of the input.
+
+	@param bytes half
+	@param bytes seed
+	@param int rounds
+	@return bytes
+	"""
+	block = half
+
+	while rounds > 0:
+		chunk = min(rounds, CHUNK_ROUNDS)
+		cipher = AES.new(seed, AES.MODE_CBC, block)
+		block = cipher.encrypt(bytes(chunk * crypto.AES_BLOCK_SIZE))[-crypto.AES_BLOCK_SIZE:]
+		rounds -= chunk
+
+	return block
+
+def transform_ecb(half, seed, rounds):
+	"""
+	Encrypt a 16 byte block `rounds` times, one round per call
+	This is the reference implementation
+
+	@param bytes half
+	@param bytes seed
+	@param int rounds
+	@return bytes
+	"""
+	cipher = AES.new(seed, AES.MODE_ECB)
+
+	for x in range(0, rounds):
+		half = cipher.encrypt(half)
+
+	return half
+
+register_backend('cbc', transform_cbc)
+register_backend('ecb', transform_ecb)
+
+def transform_key(key, seed, rounds, backend=None, cancel=None):
+	"""
+	Apply the AES-KDF key transformation to a composite key
+	Both 16 byte halves of the key are transformed independently.
+
+	@param bytes key
+	@param bytes seed
+	@param int rounds
+	@param string backend Force a specific backend
+	@param threading.Event cancel Stops the transformation with Cancelled once set
+	@return (bytes, string) Transformed key and name of the backend used
+	"""
+	if backend is not None:
+		candidates = [(backend, backends[backend])]
+	else:
+		candidates = list(backends.items())
+
+	for idx, (name, func) in enumerate(candidates):
+		try:
+			transformed = b''.join(
+				transform_half(func, key[offset:offset + crypto.AES_BLOCK_SIZE], seed, rounds, cancel)
+				for offset in range(0, len(key), crypto.AES_BLOCK_SIZE)
+			)
+
+			return transformed, name
+		except Cancelled:
+			raise
+		except Exception:
+			# Fall back to the next backend
+			if idx == len(candidates) - 1:
+				raise
+
+def transform_half(func, half, seed, rounds, cancel=None):
+	"""
+	Run a backend on one half of the key
+	With `cancel`, the rounds are split into parts so the event can be
+	checked in between. Encrypting n and then m times equals encrypting
+	n + m times, so the result is the same.
+
+	@param callable func Backend
+	@param bytes half
+	@param bytes seed
+	@param int rounds
+	@param threading.Event cancel
+	@return bytes
+	"""
+	if cancel is None:
+		return func(half, seed, rounds)
+
+	while rounds > 0:
+		if cancel.is_set():
+			raise Cancelled("Key transformation cancelled")
+
+		chunk = min(rounds, CANCEL_ROUNDS)
+		half = func(half, seed, chunk)
+		rounds -= chunk
+
+	return half
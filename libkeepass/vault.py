@@ -0,0 +1,318 @@
+import os
+import hmac
+import time
+import threading
+from collections import OrderedDict
+
+from .file import File
+from . import exporter
+
+class Vault:
+	"""
+	Open database together with the file it was read from
+	Vaults handed out by a VaultPool are checked out until released, use
+	them as context manager to release them automatically. Changes are
+	tracked through Database.changes, edits made to the XML directly
+	aren't noticed.
+	"""
+	def __init__(self, path, passphrase, key_cache=None, lazy=False, concurrent=False):
+		"""
+		Constructor
+		The database is opened right away
+
+		@param string path
+		@param string passphrase
+		@param KeyCache key_cache Optional cache of transformed keys
+		@param bool lazy Only decrypt protected values when they are accessed
+		@param bool concurrent Guard the database for use by several threads
+		"""
+		self.path = path
+		self.file = File(path, passphrase, key_cache, concurrent=concurrent)
+		self.database = self.file.open(lazy)
+		self.last_used = time.monotonic()
+
+		# Number of unreleased checkouts
+		self.users = 0
+		self._users_lock = threading.Lock()
+
+		# Database.changes at the last save
+		self._saved_changes = self.database.changes
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.release()
+		return False
+
+	def is_open(self):
+		return self.database is not None
+
+	def is_dirty(self):
+		"""
+		Check for changes since opening or the last save
+
+		@return bool
+		"""
+		return self.database is not None and self.database.changes != self._saved_changes
+
+	def touch(self):
+		self.last_used = time.monotonic()
+
+	def checkout(self):
+		"""
+		Mark vault as in use, it isn't closed by the pool until released
+		"""
+		with self._users_lock:
+			self.users += 1
+
+		self.touch()
+
+	def release(self):
+		"""
+		Give back a checked out vault
+		"""
+		with self._users_lock:
+			if self.users < 1:
+				raise Exception("Vault is not checked out")
+
+			self.users -= 1
+
+		self.touch()
+
+	def get_database(self):
+		"""
+		Get the open database
+
+		@return Database
+		"""
+		if self.database is None:
+			raise Exception("Vault is closed")
+
+		return self.database
+
+	def check_passphrase(self, passphrase):
+		"""
+		Check passphrase against the one the vault was opened with
+
+		@param string passphrase
+		@return bool
+		"""
+		return hmac.compare_digest(self.file.passphrase.encode('utf-8'), passphrase.encode('utf-8'))
+
+	def get_all_groups(self):
+		return self.get_database().get_groups()
+
+	def add_group(self, name):
+		return self.get_database().add_group(name)
+
+	def add_attachment(self, entry, path, compress=False):
+		filename = os.path.basename(path)
+		database = self.get_database()
+
+		# Garbage collection must not run between both steps
+		with database.lock.write():
+			# Add attachment to database
+			ref_id = database.add_attachment_from_path(path, compress)
+
+			# Add attachment to entry node
+			entry.add_attachment(filename, ref_id)
+
+	def save_attachment(self, attachment, path):
+		self.get_database().save_attachment(attachment.get_id(), path)
+
+	def remove_attachment(self, entry, attachment):
+		database = self.get_database()
+
+		with database.lock.write():
+			# Remove attachment from database
+			database.remove_attachment(attachment)
+
+			# Remove attachment from entry node
+			entry.remove_attachment(attachment)
+
+	def export(self, out, format='json', include_passwords=False):
+		database = self.get_database()
+
+		# Records are read from the live tree while exporting
+		with database.lock.read():
+			return exporter.export(database.iter_records(), out, format, include_passwords)
+
+	def save(self, path=None):
+		database = self.get_database()
+
+		# Changes made while saving leave the vault dirty
+		changes = database.changes
+		self.file.save(path)
+
+		# Saving a copy elsewhere leaves the vault's own file outdated
+		if path is None or os.path.realpath(path) == os.path.realpath(self.path):
+			self._saved_changes = changes
+
+	def close(self):
+		"""
+		Drop the database
+		Unsaved changes are lost, see is_dirty()
+		"""
+		self.file.database = None
+		self.database = None
+
+class VaultPool:
+	"""
+	Bounded pool of open vaults, keyed by file
+	get() checks vaults out, only released vaults are closed. When the
+	pool is full the least recently used released vault is closed, vaults
+	released for longer than `idle_timeout` are closed on the next access.
+	Vaults with unsaved changes are saved first with `save_dirty`,
+	otherwise they are kept open, so `max_size` may be exceeded while
+	all vaults are in use or dirty.
+	Pass a KeyCache to make reopening closed vaults cheap.
+	"""
+	def __init__(self, max_size=16, idle_timeout=600, key_cache=None, lazy=False, concurrent=False, save_dirty=False):
+		"""
+		Constructor
+
+		@param int max_size Maximum number of open vaults
+		@param int idle_timeout Seconds until an unused vault is closed, None to keep them
+		@param KeyCache key_cache Optional cache of transformed keys
+		@param bool lazy Open databases in lazy mode
+		@param bool concurrent Open databases for use by several threads
+		@param bool save_dirty Save vaults with unsaved changes before closing them
+		"""
+		self.max_size = max_size
+		self.idle_timeout = idle_timeout
+		self.key_cache = key_cache
+		self.lazy = lazy
+		self.concurrent = concurrent
+		self.save_dirty = save_dirty
+		self._vaults = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, path, passphrase):
+		"""
+		Check out open vault, opening it if necessary
+		Call release() on the vault when done, or use it in a with block
+
+		@param string path
+		@param string passphrase
+		@return Vault
+		"""
+		key = os.path.realpath(path)
+
+		with self._lock:
+			self._close_idle()
+
+			vault = self._vaults.get(key)
+
+			if vault is not None:
+				return self._use(key, vault, passphrase)
+
+		# Open outside the lock so other vaults stay available meanwhile
+		vault = Vault(path, passphrase, self.key_cache, self.lazy, self.concurrent)
+
+		with self._lock:
+			# Another thread may have opened it in the meantime
+			if key in self._vaults:
+				return self._use(key, self._vaults[key], passphrase)
+
+			self._vaults[key] = vault
+			vault.checkout()
+
+			self._evict(len(self._vaults) - self.max_size)
+
+			return vault
+
+	def _use(self, key, vault, passphrase):
+		"""
+		Check out pooled vault
+
+		@param string key
+		@param Vault vault
+		@param string passphrase
+		@return Vault
+		"""
+		if not vault.check_passphrase(passphrase):
+			raise Exception("Passphrase does not match")
+
+		self._vaults.move_to_end(key)
+		vault.checkout()
+
+		return vault
+
+	def close(self, path=None):
+		"""
+		Close vaults, whether in use or not
+		Closes all vaults, or only the one of the given file. Unsaved
+		changes are lost
+
+		@param string path
+		"""
+		with self._lock:
+			if path is None:
+				for vault in self._vaults.values():
+					vault.close()
+
+				self._vaults.clear()
+				return
+
+			vault = self._vaults.pop(os.path.realpath(path), None)
+
+			if vault is not None:
+				vault.close()
+
+	def _close_idle(self):
+		"""
+		Close vaults released for longer than the idle timeout
+		"""
+		if self.idle_timeout is None:
+			return
+
+		deadline = time.monotonic() - self.idle_timeout
+
+		# Least recently used vaults come first
+		for key, vault in list(self._vaults.items()):
+			if vault.last_used >= deadline:
+				break
+
+			self._try_close(key, vault)
+
+	def _evict(self, count):
+		"""
+		Close up to `count` released vaults, least recently used first
+
+		@param int count
+		"""
+		for key, vault in list(self._vaults.items()):
+			if count <= 0:
+				break
+
+			if self._try_close(key, vault):
+				count -= 1
+
+	def _try_close(self, key, vault):
+		"""
+		Close and remove a vault unless it's in use or has unsaved changes
+
+		@param string key
+		@param Vault vault
+		@return bool Whether the vault was closed
+		"""
+		if vault.users:
+			return False
+
+		if vault.is_dirty():
+			if not self.save_dirty:
+				return False
+
+			vault.save()
+
+		del self._vaults[key]
+		vault.close()
+
+		return True
+
+	def __contains__(self, path):
+		return os.path.realpath(path) in self._vaults
+
+	def __len__(self):
+		return len(self._vaults)